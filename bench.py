@@ -0,0 +1,536 @@
+"""Throughput benchmark for the backup, restore and patch jobs.
+
+Runs the engine jobs against a local SQLite database behind a stand-in for
+the mssql_python driver, so no SQL Server is needed. Synthetic _Char,
+_RefSkill and _RefObjItem tables are generated at each requested size and
+rows per second are measured for BackupJob, PatchJob and RestoreJob, e.g.:
+
+    python bench.py --rows 10k,100k,1M --output bench_output.txt
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json --tolerance 0.25
+
+The stand-in only understands the T-SQL the jobs emit for full backups,
+restores and the shipped patches; incremental backups are not supported.
+Absolute numbers are not comparable with SQL Server, but relative changes
+between two builds are.
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+from engine import BackupJob, ConnectionPool, PatchJob, RestoreJob
+from patches import PATCHES
+
+# Benchmark scenarios: the backed-up tables, the patch applied to them and
+# any other table the patch reads
+SCENARIOS = {
+    "_Char": {
+        "tables": ["_Char"],
+        "patch": "Add gold to all characters",
+        "extra_tables": [],
+    },
+    "_RefSkill": {
+        "tables": ["_RefSkill"],
+        "patch": "Level 120 Skills",
+        "extra_tables": [],
+    },
+    "_RefObjItem": {
+        "tables": ["_RefObjItem"],
+        "patch": "Increase MaxStack to 1000",
+        "extra_tables": ["_RefObjCommon"],
+    },
+}
+
+# Synthetic table definitions: (DDL, SELECT generating a row from the counter i)
+TABLES = {
+    "_Char": (
+        """CREATE TABLE _Char (
+            CharID INTEGER PRIMARY KEY, CharName16 TEXT, MaxLevel INT,
+            Strength INT, Intellect INT, RemainStatPoint INT, RemainGold INT
+        )""",
+        """SELECT i, 'Char' || i, 1 + i % 120, 20 + i % 50, 20 + i % 40,
+            i % 30, i * 7 % 1000000""",
+    ),
+    "_RefSkill": (
+        """CREATE TABLE _RefSkill (
+            ID INTEGER PRIMARY KEY, Service INT, Basic_Code TEXT,
+            ReqCommon_MasteryLevel1 INT
+        )""",
+        """SELECT i, i % 2,
+            CASE i % 3 WHEN 0 THEN 'SKILL_CH_' WHEN 1 THEN 'SKILL_EU_'
+                ELSE 'SKILL_OTHER_' END || i,
+            i % 140""",
+    ),
+    "_RefObjCommon": (
+        """CREATE TABLE _RefObjCommon (
+            ID INTEGER PRIMARY KEY, Service INT, CodeName128 TEXT
+        )""",
+        """SELECT i, 1,
+            CASE i % 4 WHEN 0 THEN 'ITEM_ETC_' WHEN 1 THEN 'ITEM_CH_SWORD_12_'
+                ELSE 'ITEM_EU_BOW_' END || i""",
+    ),
+    "_RefObjItem": (
+        "CREATE TABLE _RefObjItem (ID INTEGER PRIMARY KEY, MaxStack INT)",
+        "SELECT i, CASE i % 3 WHEN 0 THEN 50 WHEN 1 THEN 1 ELSE 250 END",
+    ),
+}
+
+
+def quoted_names(sql, pattern):
+    """Return the quoted names of the first match of pattern in sql."""
+    match = re.search(pattern, sql)
+    return re.findall(r"'((?:[^']|'')*)'", match.group(1)) if match else []
+
+
+def table_exists(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def query_objects(conn, sql):
+    """sys.objects: one row per existing table, keyed by its DDL."""
+    rows = []
+    for name in quoted_names(sql, r"name IN \(([^)]*)\)"):
+        row = conn.execute(
+            "SELECT rowid, sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (name,),
+        ).fetchone()
+        if row is not None:
+            rows.append((name, row[0], row[1]))
+    return rows
+
+
+def query_catalog(conn, sql):
+    """SchemaCatalog._load: columns with primary key ordinals, then indexes."""
+    rows = []
+    for name in quoted_names(sql, r"o\.name IN \(([^)]*)\)"):
+        for cid, column, type_name, _, _, pk in conn.execute(
+            f"PRAGMA table_info([{name}])"
+        ):
+            # SQL Server spells SQLite's INTEGER primary keys int
+            type_name = "int" if type_name.upper() == "INTEGER" else type_name
+            rows.append((name, "C", column, type_name, cid + 1, pk))
+        for _, index, unique, _, _ in conn.execute(f"PRAGMA index_list([{name}])"):
+            for seqno, _, column in conn.execute(f"PRAGMA index_info([{index}])"):
+                rows.append((name, "I", index, column, seqno + 1, unique))
+    return rows
+
+
+def query_row_counts(conn, sql):
+    """sys.dm_db_partition_stats: exact counts; other databases count as 0.
+
+    Sizes, when asked for, are estimated at 100 bytes per row.
+    """
+    rows = []
+    for name in quoted_names(sql, r"VALUES (.*?) v\(name\)"):
+        table = name.split(".")[-1]
+        count = 0
+        if name.count(".") < 2 and table_exists(conn, table):
+            count = conn.execute(f"SELECT COUNT(*) FROM [{table}]").fetchone()[0]
+        rows.append(
+            (name, count, count * 100) if "used_page_count" in sql else (name, count)
+        )
+    return rows
+
+
+def query_object_id(conn, sql):
+    """OBJECT_ID of a table: its rowid in sqlite_master, or NULL."""
+    name = quoted_names(sql, r"OBJECT_ID\((.*?)\)")[0]
+    row = conn.execute(
+        "SELECT rowid FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return [(row[0] if row else None,)]
+
+
+# Catalog queries answered from SQLite metadata instead of being translated
+QUERY_HANDLERS = [
+    (re.compile(r"FROM sys\.objects WHERE type = 'U'"), query_objects),
+    (re.compile(r"INNER JOIN sys\.columns"), query_catalog),
+    (re.compile(r"sys\.dm_db_partition_stats"), query_row_counts),
+    (re.compile(r"sys\.foreign_keys"), lambda conn, sql: []),
+    (re.compile(r"^SELECT OBJECT_ID\('\w+', 'U'\)$"), query_object_id),
+    (
+        re.compile(r"@@VERSION"),
+        lambda conn, sql: [(f"SQLite {sqlite3.sqlite_version}",)],
+    ),
+]
+
+UPDATE_FROM = re.compile(
+    r"^UPDATE (\w+) SET (.*?) FROM (\S+) (?:AS )?\1 INNER JOIN (.*?) (?:AS )?(\w+) "
+    r"ON (.*?)(?: WHERE (.*))?$"
+)
+
+
+def translate(sql):
+    """Rewrite the T-SQL emitted by the jobs into SQLite."""
+    sql = " ".join(sql.split())
+    sql = re.sub(r"\bdbo\.", "", sql)
+    sql = re.sub(r"\bISNULL\(", "IFNULL(", sql)
+    # Session temp tables become ordinary tables; SQLite has no clustered indexes
+    sql = re.sub(r"(?<=\s)#(\w+)", r"temp_\1", sql)
+    sql = sql.replace(" CLUSTERED INDEX ", " INDEX ")
+
+    # Derived VALUES tables with column aliases
+    def values_table(match):
+        rows, alias, columns = match.groups()
+        names = ", ".join(
+            f"column{i} AS {column.strip()}"
+            for i, column in enumerate(columns.split(","), 1)
+        )
+        return f"(SELECT {names} FROM (VALUES {rows})) {alias}"
+
+    sql = re.sub(
+        r"\(VALUES ((?:\([^()]*\)(?:, )?)+)\) (\w+)\(([^)]*)\)", values_table, sql
+    )
+
+    match = re.match(
+        r"^IF OBJECT_ID\('(\w+)', 'U'\) IS NULL CREATE TABLE \1 (.*)$", sql
+    )
+    if match:
+        return f"CREATE TABLE IF NOT EXISTS {match.group(1)} {match.group(2)}"
+
+    match = re.match(r"^EXEC sp_rename '(\w+)', '(\w+)'$", sql)
+    if match:
+        return f"ALTER TABLE {match.group(1)} RENAME TO {match.group(2)}"
+
+    match = re.match(r"^IF OBJECT_ID\('(\w+)', 'U'\) IS NOT NULL DROP TABLE \1$", sql)
+    if match:
+        return f"DROP TABLE IF EXISTS {match.group(1)}"
+
+    # Empty copies, loaded and compressed separately on SQL Server
+    if sql.startswith("ALTER TABLE ") and " REBUILD " in sql:
+        return "SELECT 1"
+    sql = sql.replace(" WITH (TABLOCK)", "")
+    sql = re.sub(r"^SELECT TOP \(0\) (.*)$", r"SELECT \1 LIMIT 0", sql)
+
+    match = re.match(r"^SELECT (.*?) INTO (\w+) FROM (.*)$", sql)
+    if match:
+        columns, table, rest = match.groups()
+        return f"CREATE TABLE {table} AS SELECT {columns} FROM {rest}"
+
+    sql = re.sub(
+        r"SELECT TOP \((\d+)\) (.*?) ORDER BY (.*?) \)",
+        r"SELECT \2 ORDER BY \3 LIMIT \1 )",
+        sql,
+    )
+
+    match = UPDATE_FROM.match(sql)
+    if match:
+        alias, assignments, table, source, source_alias, on, where = match.groups()
+        assignments = re.sub(rf"(^|,)\s*{alias}\.", r"\1 ", assignments).strip()
+        sql = (
+            f"UPDATE {table} AS {alias} SET {assignments} "
+            f"FROM {source} AS {source_alias} WHERE ({on})"
+        )
+        return f"{sql} AND ({where})" if where else sql
+
+    match = re.match(r"^DELETE (\w+) FROM (\w+) (?:AS )?\1 (.*)$", sql)
+    if match:
+        alias, table, rest = match.groups()
+        return f"DELETE FROM {table} AS {alias} {rest}"
+
+    return sql
+
+
+class StandInCursor:
+    """DB-API cursor with the mssql_python calling convention over SQLite."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn.cursor()
+        self._rows = None
+        self.rowcount = -1
+        self.messages = []
+
+    def execute(self, sql, *params):
+        self._rows = None
+        self.rowcount = -1
+        if sql.lstrip().upper().startswith("SET "):
+            return self
+        normalized = " ".join(sql.split())
+        for pattern, handler in QUERY_HANDLERS:
+            if pattern.search(normalized):
+                self._rows = handler(self._conn, normalized)
+                return self
+        sql = translate(sql)
+        params = [
+            param.isoformat(" ") if isinstance(param, datetime) else param
+            for param in params
+        ]
+        self._cursor.execute(sql, params)
+        self.rowcount = self._cursor.rowcount
+        self.index_copy(sql)
+        return self
+
+    def index_copy(self, sql):
+        """Index a SELECT INTO copy on the primary key of its source table.
+
+        SQL Server joins a heap copy back to its source with a hash join,
+        while SQLite would fall back to nested loops; the index keeps the
+        restore benchmark linear like on the real server.
+        """
+        match = re.match(
+            r"^CREATE TABLE (\w+) AS SELECT (?:t\.)?\* FROM "
+            r"(?:\(SELECT 1 AS Dummy\) d LEFT JOIN )?(\w+)(?: t ON 1 = 0 LIMIT 0)?$",
+            sql,
+        )
+        if not match:
+            return
+        copy, source = match.groups()
+        pk_columns = [
+            row[1]
+            for row in sorted(
+                self._conn.execute(f"PRAGMA table_info([{source}])"),
+                key=lambda row: row[5],
+            )
+            if row[5]
+        ]
+        if pk_columns:
+            columns = ", ".join([f"[{col}]" for col in pk_columns])
+            # Index names are database-wide in SQLite and survive renames
+            index = f"IX_{copy}_{os.urandom(4).hex()}"
+            self._cursor.execute(f"CREATE INDEX [{index}] ON [{copy}] ({columns})")
+
+    def executemany(self, sql, seq_of_parameters):
+        self._rows = None
+        self._cursor.executemany(translate(sql), seq_of_parameters)
+        self.rowcount = self._cursor.rowcount
+        return self
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.pop(0) if self._rows else None
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return rows
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+def binary_checksum(*values):
+    """Stand-in for BINARY_CHECKSUM: a signed 32-bit hash of the values."""
+    return zlib.crc32(repr(values).encode()) - 2**31
+
+
+class ChecksumAgg:
+    """Stand-in for CHECKSUM_AGG: XOR of the non-NULL values."""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = (self.value or 0) ^ value
+
+    def finalize(self):
+        return self.value
+
+
+class StandInConnection:
+    """DB-API connection to a SQLite file standing in for SQL Server."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.create_function("BINARY_CHECKSUM", -1, binary_checksum)
+        self._conn.create_aggregate("CHECKSUM_AGG", 1, ChecksumAgg)
+
+    def cursor(self):
+        return StandInCursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(connection_string):
+    """Stand-in for mssql_python.connect; the connection string is a file path."""
+    return StandInConnection(connection_string)
+
+
+def parse_rows(text):
+    """Parse a comma-separated list of row counts such as 10k,100k,1M."""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    counts = []
+    for item in text.split(","):
+        item = item.strip().lower()
+        multiplier = multipliers.get(item[-1:], 1)
+        counts.append(int(float(item.rstrip("km")) * multiplier))
+    return counts
+
+
+def populate(path, tables, rows):
+    """Create the synthetic tables with rows rows each."""
+    conn = sqlite3.connect(path)
+    try:
+        for table in tables:
+            ddl, generator = TABLES[table]
+            conn.execute(ddl)
+            conn.execute(
+                f"""
+                WITH RECURSIVE n(i) AS (
+                    SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?
+                )
+                INSERT INTO {table} {generator} FROM n
+                """,
+                (rows,),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_scenario(directory, name, rows, batch_size):
+    """Benchmark one scenario and return {operation: (seconds, rows per second)}."""
+    scenario = SCENARIOS[name]
+    path = os.path.join(directory, f"{name}-{rows}.db")
+    populate(path, scenario["tables"] + scenario["extra_tables"], rows)
+
+    pool = ConnectionPool(path, connect=connect)
+    patch_name = scenario["patch"]
+    jobs = [
+        (
+            "backup",
+            BackupJob(
+                pool,
+                scenario["tables"],
+                columns=PATCHES[patch_name]["backup_columns"],
+            ),
+        ),
+        ("patch", PatchJob(pool, patch_name, PATCHES[patch_name], batch_size)),
+        ("restore", RestoreJob(pool, scenario["tables"])),
+    ]
+
+    results = {}
+    try:
+        for operation, job in jobs:
+            job.report_dir = os.path.join(directory, "reports")
+            start = time.perf_counter()
+            job.run()
+            seconds = time.perf_counter() - start
+            results[operation] = (seconds, rows / seconds if seconds else 0.0)
+    finally:
+        pool.close()
+        os.remove(path)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every result slower than the baseline beyond tolerance."""
+    regressions = []
+    for key, rate in results.items():
+        expected = baseline.get(key)
+        if expected and rate < expected * (1 - tolerance):
+            regressions.append(
+                f"{key}: {rate:,.0f} rows/s, baseline {expected:,.0f} rows/s "
+                f"({rate / expected - 1:+.0%})"
+            )
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark backup, restore and patch throughput on SQLite"
+    )
+    parser.add_argument(
+        "--rows",
+        default="10k,100k",
+        help="comma-separated table sizes, e.g. 10k,100k,1M,10M (default: 10k,100k)",
+    )
+    parser.add_argument(
+        "--tables",
+        default=",".join(SCENARIOS),
+        help=f"comma-separated scenarios (default: {','.join(SCENARIOS)})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help="run patches in committed chunks of this many rows (default: 0)",
+    )
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--save", help="save rows per second as a JSON baseline")
+    parser.add_argument(
+        "--compare", help="fail if slower than this JSON baseline beyond tolerance"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline (default: 0.25)",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    names = [name.strip() for name in args.tables.split(",")]
+    for name in names:
+        if name not in SCENARIOS:
+            sys.exit(f"Unknown scenario: {name}")
+
+    lines = [f"{'Scenario':<14}{'Rows':>12}  {'Job':<8}{'Seconds':>10}{'Rows/s':>14}"]
+    print(lines[0], flush=True)
+    rates = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in parse_rows(args.rows):
+            for name in names:
+                results = run_scenario(directory, name, rows, args.batch_size)
+                for operation, (seconds, rate) in results.items():
+                    rates[f"{name}/{rows}/{operation}"] = rate
+                    line = (
+                        f"{name:<14}{rows:>12,}  {operation:<8}"
+                        f"{seconds:>10.3f}{rate:>14,.0f}"
+                    )
+                    lines.append(line)
+                    print(line, flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(rates, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(rates, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+"""Command line interface for the database patch tool.
+
+Runs the same engine jobs as the GUI but never imports Qt, so it starts
+quickly and can be used from cron or CI, e.g.:
+
+    srodbpatch apply "Add gold to all characters"
+"""
+
+import argparse
+import os
+import re
+import sys
+
+from engine import (
+    CONFIG_FILE,
+    BackupJob,
+    EstimateJob,
+    ExportJob,
+    FanOutJob,
+    PatchJob,
+    RestoreJob,
+    combine_patches,
+    create_pool,
+    get_targets,
+    get_version,
+    load_config,
+)
+from patches import PATCHES
+
+
+def print_progress(message):
+    """Print a progress message to stderr so stdout only carries results."""
+    print(message, file=sys.stderr, flush=True)
+
+
+def get_patch(name):
+    """Return the configuration of a patch or exit with an error."""
+    if name not in PATCHES:
+        sys.exit(f"Unknown patch: {name}\nRun 'srodbpatch list' to see all patches.")
+    return PATCHES[name]
+
+
+def get_parameters(args):
+    """Return the --param NAME=VALUE options as a dict."""
+    parameters = {}
+    for option in args.param or []:
+        name, separator, value = option.partition("=")
+        if not separator:
+            sys.exit(f"Invalid parameter '{option}', expected NAME=VALUE")
+        parameters[name.strip()] = value.strip()
+    return parameters
+
+
+def get_batch_size(args, config):
+    """Return the chunk size of batched execution (0 = disabled)."""
+    return config["batch_size"] if args.batch_size is None else args.batch_size
+
+
+def get_throttle(args, config):
+    """Return the latency budget of the throttle mode in ms (0 = disabled)."""
+    return config["throttle_latency_ms"] if args.throttle is None else args.throttle
+
+
+def get_combined_patch(names):
+    """Return (name, config) of one patch, or of several combined into one unit."""
+    if len(names) == 1:
+        return names[0], get_patch(names[0])
+    for name in names:
+        get_patch(name)
+    return " + ".join(names), combine_patches(PATCHES, names)
+
+
+def cmd_list(args, config, pool):
+    """List available patches."""
+    for name, patch_config in PATCHES.items():
+        tables = ", ".join(patch_config["backup_tables"])
+        print(f"{name}\n    {patch_config['description']}\n    Tables: {tables}")
+        for table, columns in patch_config["backup_columns"].items():
+            print(f"    Backed-up columns of {table}: {', '.join(columns)}")
+        for parameter, declaration in patch_config.get("parameters", {}).items():
+            print(
+                f"    Parameter: {parameter} ({declaration['type']}, "
+                f"default {declaration.get('default')})"
+            )
+
+
+def cmd_test(args, config, pool):
+    """Test the database connection."""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT @@VERSION")
+        version = cursor.fetchone()
+    print(f"Successfully connected to database!\n\nServer version:\n{version[0]}")
+
+
+def cmd_backup(args, config, pool):
+    """Create a backup of the tables of a patch."""
+    patch_config = get_patch(args.patch)
+    return BackupJob(
+        pool,
+        patch_config["backup_tables"],
+        args.incremental,
+        args.workers or config["workers"],
+        verify=args.verify,
+        columns=None if args.all_columns else patch_config["backup_columns"],
+    )
+
+
+def get_export_dir(args, config, directory):
+    """Return the export directory; every target gets its own subdirectory."""
+    if not getattr(args, "targets", None):
+        return directory
+    name = re.sub(r"[^\w.-]+", "_", f"{config['server']}_{config['database']}")
+    return os.path.join(directory, name)
+
+
+def cmd_restore(args, config, pool):
+    """Restore the tables of a patch from backup."""
+    patch_config = get_patch(args.patch)
+    source_dir = args.source_dir and get_export_dir(args, config, args.source_dir)
+    return RestoreJob(
+        pool,
+        patch_config["backup_tables"],
+        args.workers or config["workers"],
+        source_dir,
+        args.batch_size,
+        args.generation,
+        get_throttle(args, config),
+        args.verify,
+        patch_config["backup_columns"],
+    )
+
+
+def cmd_backups(args, config, pool):
+    """List the backup generations of the tables of a patch."""
+    tables = get_patch(args.patch)["backup_tables"]
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        for table in tables:
+            print(table)
+            generations = pool.backups.generations(cursor, table)
+            if not generations:
+                print("    no backups")
+            for generation in generations:
+                current = (
+                    " (current)"
+                    if generation["backup_table"] == pool.catalog.backup_name(table)
+                    else ""
+                )
+                print(
+                    f"    {generation['generation']}{current}: "
+                    f"{generation['rows']} rows, {generation['bytes'] / 1024**2:.1f} MB, "
+                    f"source {generation['source'] or 'manual backup'}"
+                )
+
+
+def cmd_export(args, config, pool):
+    """Export the tables of a patch to compressed files."""
+    tables = get_patch(args.patch)["backup_tables"]
+    directory = get_export_dir(args, config, args.dir)
+    return ExportJob(pool, tables, directory, args.fetch_size)
+
+
+def cmd_apply(args, config, pool):
+    """Apply a patch."""
+    name, patch_config = get_combined_patch(args.patch)
+    return PatchJob(
+        pool,
+        name,
+        patch_config,
+        get_batch_size(args, config),
+        get_parameters(args),
+        get_throttle(args, config),
+    )
+
+
+def cmd_estimate(args, config, pool):
+    """Estimate the rows a patch would affect without changing data."""
+    name, patch_config = get_combined_patch(args.patch)
+    return EstimateJob(pool, name, patch_config, args.exact, get_parameters(args))
+
+
+def make_fan_out_job(args, config):
+    """Wrap the command in a FanOutJob over the targets given with --targets."""
+    targets = get_targets(config, args.targets.split(","))
+    # Batched and throttled patches commit every chunk, so a failed attempt
+    # cannot be rerun; combined patches always run in one transaction
+    if args.command == "apply" and args.retries and len(args.patch) == 1:
+        chunked = [
+            name
+            for name, target_config in targets
+            if get_batch_size(args, target_config) or get_throttle(args, target_config)
+        ]
+        if chunked:
+            sys.exit(
+                "--retries cannot be combined with batched or throttled apply, "
+                f"which commits every chunk (targets: {', '.join(chunked)})"
+            )
+
+    def make_jobs(pool, target_config):
+        jobs = [args.func(args, target_config, pool)]
+        if args.command == "apply":
+            # Always take a fresh backup on every shard before patching
+            patch_config = get_combined_patch(args.patch)[1]
+            jobs.insert(
+                0,
+                BackupJob(
+                    pool,
+                    patch_config["backup_tables"],
+                    False,
+                    target_config["workers"],
+                    " + ".join(args.patch),
+                    columns=patch_config["backup_columns"],
+                ),
+            )
+        return jobs
+
+    return FanOutJob(targets, make_jobs, args.concurrency, args.retries, args.fail_fast)
+
+
+def add_target_arguments(parser):
+    """Add the multi-target fan-out options to a subcommand parser."""
+    parser.add_argument(
+        "--targets",
+        help="comma-separated target names from the configuration file, or 'all'",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="number of targets processed at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="retries per failed target (default: 0); not allowed for batched "
+        "or throttled apply",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="skip targets that have not started after the first failure",
+    )
+
+
+def add_parameter_argument(parser):
+    """Add the --param option for patch parameters to a subcommand parser."""
+    parser.add_argument(
+        "--param",
+        action="append",
+        metavar="NAME=VALUE",
+        help="value of a patch parameter; may be given several times",
+    )
+
+
+def add_throttle_argument(parser, note=""):
+    """Add the --throttle option for the adaptive throttle mode."""
+    parser.add_argument(
+        "--throttle",
+        type=int,
+        metavar="MS",
+        help="slow down while server waits exceed MS milliseconds (0 = disabled)"
+        + note,
+    )
+
+
+def add_verify_argument(parser):
+    """Add the --no-verify option that skips the checksum comparison."""
+    parser.add_argument(
+        "--no-verify",
+        dest="verify",
+        action="store_false",
+        help="skip comparing the tables with their backup by checksums",
+    )
+
+
+def build_parser():
+    """Build the argument parser."""
+    parser = argparse.ArgumentParser(
+        prog="srodbpatch", description="Generic Database Patch Management Tool"
+    )
+    parser.add_argument(
+        "--version", action="version", version=f"%(prog)s {get_version()}"
+    )
+    parser.add_argument(
+        "--config",
+        default=CONFIG_FILE,
+        help=f"database configuration file (default: {CONFIG_FILE})",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="list available patches")
+    list_parser.set_defaults(func=cmd_list)
+
+    test_parser = subparsers.add_parser("test", help="test the database connection")
+    test_parser.set_defaults(func=cmd_test)
+
+    backup_parser = subparsers.add_parser(
+        "backup", help="back up the tables of a patch"
+    )
+    backup_parser.add_argument("patch", help="patch name")
+    backup_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="store only rows changed since the last backup; tables whose backup "
+        "does not hold the columns of the patch get a new generation instead",
+    )
+    backup_parser.add_argument(
+        "--all-columns",
+        action="store_true",
+        help="back up whole rows even if the patch only changes some columns",
+    )
+    backup_parser.add_argument(
+        "--workers", type=int, help="number of tables backed up in parallel"
+    )
+    add_verify_argument(backup_parser)
+    add_target_arguments(backup_parser)
+    backup_parser.set_defaults(func=cmd_backup)
+
+    restore_parser = subparsers.add_parser(
+        "restore", help="restore the tables of a patch from backup"
+    )
+    restore_parser.add_argument("patch", help="patch name")
+    restore_parser.add_argument(
+        "--workers", type=int, help="number of tables restored in parallel"
+    )
+    restore_parser.add_argument(
+        "--generation",
+        help="restore this backup generation instead of the current backup "
+        "(see 'backups')",
+    )
+    restore_parser.add_argument(
+        "--from",
+        dest="source_dir",
+        metavar="DIR",
+        help="restore from files written by 'export' instead of the backup tables",
+    )
+    restore_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="rows per insert batch when restoring --from files (default: 1000)",
+    )
+    add_throttle_argument(restore_parser)
+    add_verify_argument(restore_parser)
+    add_target_arguments(restore_parser)
+    restore_parser.set_defaults(func=cmd_restore)
+
+    backups_parser = subparsers.add_parser(
+        "backups", help="list the backup generations of the tables of a patch"
+    )
+    backups_parser.add_argument("patch", help="patch name")
+    backups_parser.set_defaults(func=cmd_backups)
+
+    export_parser = subparsers.add_parser(
+        "export", help="export the tables of a patch to compressed files"
+    )
+    export_parser.add_argument("patch", help="patch name")
+    export_parser.add_argument(
+        "--dir", default="exports", help="output directory (default: exports)"
+    )
+    export_parser.add_argument(
+        "--fetch-size",
+        type=int,
+        default=5000,
+        help="rows fetched from the server at a time (default: 5000)",
+    )
+    add_target_arguments(export_parser)
+    export_parser.set_defaults(func=cmd_export)
+
+    apply_parser = subparsers.add_parser("apply", help="apply a patch")
+    apply_parser.add_argument(
+        "patch",
+        nargs="+",
+        help="patch name; several patches are applied in one transaction",
+    )
+    apply_parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="run statements in committed chunks of this many rows (0 = disabled); "
+        "ignored when applying several patches",
+    )
+    add_parameter_argument(apply_parser)
+    add_throttle_argument(
+        apply_parser, "; runs the patch in chunks, each committed separately"
+    )
+    add_target_arguments(apply_parser)
+    apply_parser.set_defaults(func=cmd_apply)
+
+    estimate_parser = subparsers.add_parser(
+        "estimate", help="dry run: estimate the rows a patch would affect"
+    )
+    estimate_parser.add_argument(
+        "patch", nargs="+", help="patch name; several patches are estimated together"
+    )
+    estimate_parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="execute the statements in a transaction that is rolled back",
+    )
+    add_parameter_argument(estimate_parser)
+    add_target_arguments(estimate_parser)
+    estimate_parser.set_defaults(func=cmd_estimate)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = load_config(args.config)
+    pool = create_pool(config)
+
+    job = None
+    try:
+        if getattr(args, "targets", None):
+            job = make_fan_out_job(args, config)
+        else:
+            job = args.func(args, config, pool)
+        if job is not None:
+            job.on_progress = print_progress
+            job.on_row_progress = print_progress
+            print(job.run())
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        pool.close()
+        if job is not None and job.report_path:
+            print(f"Run report: {job.report_path}", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
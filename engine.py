@@ -0,0 +1,3623 @@
+"""Database patch engine: backup, restore and patch operations without any GUI.
+
+Both the Qt application in main.py and the command line interface in cli.py
+are thin clients on top of the jobs defined here.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib.metadata import version, PackageNotFoundError
+
+
+def get_version():
+    """Read version from package metadata or pyproject.toml"""
+    try:
+        return version("srodbpatch")
+    except PackageNotFoundError:
+        pass
+
+    try:
+        import tomllib
+
+        pyproject_path = os.path.join(os.path.dirname(__file__), "pyproject.toml")
+        with open(pyproject_path, "rb") as f:
+            pyproject = tomllib.load(f)
+        return pyproject["project"]["version"]
+    except Exception as e:
+        raise RuntimeError(
+            "Could not determine version. Please ensure:\n"
+            "1. Package is installed with 'uv pip install -e .', or\n"
+            "2. pyproject.toml is accessible in the application directory.\n"
+            f"Error: {e}"
+        )
+
+
+CONFIG_FILE = "db_config.json"
+
+# Directory that receives one JSON-lines run report per job
+REPORT_DIR = "reports"
+
+DEFAULT_CONFIG = {
+    "server": "localhost",
+    "port": 1433,
+    "database": "SRO_VT_SHARD",
+    "user": "sa",
+    "password": "",
+    "batch_size": 0,
+    "workers": 1,
+    # Jobs the GUI runs at the same time; jobs on the same tables always run
+    # one after another, see JobScheduler
+    "parallel_jobs": 2,
+    # Backup retention per table: generations to keep and total size in GB;
+    # 0 opts out of a limit. The current backup is never evicted.
+    "backup_keep": 5,
+    "backup_max_gb": 0,
+    # Milliseconds to wait for a lock before giving up (-1 = forever) and
+    # retries of a unit of work after a lock timeout or deadlock
+    "lock_timeout_ms": 5000,
+    "lock_retries": 3,
+    # Latency budget in ms of the throttle mode for patches and restores
+    # (0 = no throttling), see ThrottleGovernor
+    "throttle_latency_ms": 0,
+    # Where backup tables are kept: another database and/or schema of the
+    # server ("" = next to the tables), and their data compression
+    # (PAGE, ROW or NONE)
+    "backup_database": "",
+    "backup_schema": "",
+    "backup_compression": "PAGE",
+}
+
+
+def load_config(path=CONFIG_FILE):
+    """Load database configuration from file, falling back to defaults."""
+    config = dict(DEFAULT_CONFIG)
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                config.update(json.load(f))
+        except Exception:
+            pass
+    return config
+
+
+def save_config(config, path=CONFIG_FILE):
+    """Save database configuration to file."""
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def get_connection_string(config):
+    """Get the database connection string for a configuration."""
+    return (
+        f"SERVER={config['server']},{config['port']};"
+        f"DATABASE={config['database']};"
+        f"UID={config['user']};"
+        f"PWD={config['password']};"
+        f"Encrypt=yes;"
+        f"TrustServerCertificate=yes;"
+    )
+
+
+def _find_top_level_keyword(sql, keyword, first=False):
+    """Return the index of keyword outside of parentheses and string literals, or -1.
+
+    The last occurrence is returned unless first is set.
+    """
+    depth = 0
+    in_string = False
+    pattern = re.compile(rf"\b{keyword}\b", re.IGNORECASE)
+    found = -1
+    for idx, char in enumerate(sql):
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif (
+            depth == 0
+            and pattern.match(sql, idx)
+            and (idx == 0 or not (sql[idx - 1].isalnum() or sql[idx - 1] == "_"))
+        ):
+            found = idx
+            if first:
+                break
+    return found
+
+
+def add_predicate(sql, predicate):
+    """Add an extra predicate to the top-level WHERE clause of a statement."""
+    where_idx = _find_top_level_keyword(sql, "WHERE")
+    if where_idx == -1:
+        return f"{sql.rstrip()}\nWHERE {predicate}"
+    condition = sql[where_idx + len("WHERE") :].strip()
+    return f"{sql[:where_idx]}WHERE ({condition})\n  AND {predicate}"
+
+
+def parse_update_target(sql):
+    """Return (table, alias) of an UPDATE statement, or None for other statements.
+
+    Handles both "UPDATE dbo._Char SET ..." and "UPDATE i SET ... FROM _RefObjItem i ...".
+    """
+    match = re.match(r"\s*UPDATE\s+([\w.\[\]]+)\s+SET\s", sql, re.IGNORECASE)
+    if not match:
+        return None
+    target = match.group(1)
+    from_match = re.search(
+        rf"\bFROM\s+([\w.\[\]]+)\s+(?:AS\s+)?{re.escape(target)}\b",
+        sql,
+        re.IGNORECASE,
+    )
+    if from_match:
+        return from_match.group(1), target
+    if _find_top_level_keyword(sql, "FROM") != -1:
+        # Aliased FROM clause we cannot resolve - not safe to batch
+        return None
+    return target, None
+
+
+def _split_top_level(sql):
+    """Split sql at commas outside of parentheses and string literals."""
+    parts = []
+    depth = 0
+    in_string = False
+    start = 0
+    for idx, char in enumerate(sql):
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(sql[start:idx])
+            start = idx + 1
+    parts.append(sql[start:])
+    return parts
+
+
+def parse_set_columns(sql):
+    """Return the columns assigned in the SET clause of an UPDATE statement.
+
+    Returns None for other statements and for SET clauses that cannot be
+    parsed, such as ones assigning variables.
+    """
+    match = re.match(r"\s*UPDATE\s+[\w.\[\]]+\s+SET\s", sql, re.IGNORECASE)
+    if not match:
+        return None
+    clause = sql[match.end() :]
+    ends = [
+        idx
+        for idx in (
+            _find_top_level_keyword(clause, keyword, first=True)
+            for keyword in ("FROM", "WHERE", "OUTPUT", "OPTION")
+        )
+        if idx != -1
+    ]
+    if ends:
+        clause = clause[: min(ends)]
+
+    columns = []
+    for assignment in _split_top_level(clause):
+        target = re.match(r"\s*(?:[\w\[\]]+\.)?\[?(\w+)\]?\s*[-+*/%&|^]?=", assignment)
+        if target is None:
+            return None
+        if target.group(1).lower() not in [column.lower() for column in columns]:
+            columns.append(target.group(1))
+    return columns
+
+
+def build_count_query(sql):
+    """Return a SELECT COUNT(*) matching the rows a DML statement would touch.
+
+    Covers UPDATE, DELETE, INSERT ... SELECT and MERGE, whose count is that of
+    its source rows; returns None for anything else. For joined UPDATE/DELETE
+    statements the count is an estimate, as a target row matched by several
+    joined rows is only written once.
+    """
+    match = re.match(r"\s*(UPDATE|DELETE|INSERT|MERGE)\b", sql, re.IGNORECASE)
+    if not match:
+        return None
+    verb = match.group(1).upper()
+
+    if verb == "MERGE":
+        using = re.search(
+            r"\bUSING\s+(.+?)\s+(?:AS\s+)?(\w+)\s+ON\b", sql, re.IGNORECASE | re.DOTALL
+        )
+        if using is None:
+            return None
+        return f"SELECT COUNT(*) FROM {using.group(1)} {using.group(2)}"
+
+    if verb == "INSERT":
+        select_idx = _find_top_level_keyword(sql, "SELECT", first=True)
+        if select_idx == -1:
+            return None
+        query = sql[select_idx:]
+        from_idx = _find_top_level_keyword(query, "FROM", first=True)
+        if from_idx == -1 or any(
+            _find_top_level_keyword(query, keyword) != -1
+            for keyword in ("DISTINCT", "TOP", "GROUP", "UNION", "EXCEPT", "INTERSECT")
+        ):
+            return None
+        return f"SELECT COUNT(*) {query[from_idx:]}"
+
+    from_idx = _find_top_level_keyword(sql, "FROM")
+    if from_idx != -1:
+        return f"SELECT COUNT(*) {sql[from_idx:]}"
+    if verb == "DELETE":
+        return None
+
+    target = parse_update_target(sql)
+    if target is None:
+        return None
+    where_idx = _find_top_level_keyword(sql, "WHERE")
+    where = sql[where_idx:] if where_idx != -1 else ""
+    return f"SELECT COUNT(*) FROM {target[0]} {where}"
+
+
+# Types patch parameters can be declared with
+PARAMETER_TYPES = {"int": int, "decimal": Decimal, "str": str}
+
+
+def get_parameter_values(patch_config, values=None):
+    """Return {name: typed value} for the parameters a patch declares.
+
+    values maps parameter names to given values, e.g. strings entered in the
+    GUI or CLI; parameters that are not given take their declared default.
+    """
+    values = values or {}
+    declared = patch_config.get("parameters", {})
+    unknown = [name for name in values if name not in declared]
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+
+    result = {}
+    for name, parameter in declared.items():
+        value = values.get(name, parameter.get("default"))
+        if value is None:
+            raise ValueError(f"Missing value for parameter {name}")
+        try:
+            result[name] = PARAMETER_TYPES[parameter["type"]](value)
+        except (ValueError, ArithmeticError):
+            raise ValueError(
+                f"Invalid {parameter['type']} value for parameter {name}: {value}"
+            )
+    return result
+
+
+def bind_parameters(sql, values):
+    """Replace the @name markers of patch parameters with ? placeholders.
+
+    Returns (sql, params) with params in placeholder order, ready to be bound
+    by the driver. String literals and unknown @names are left untouched.
+    """
+    if not values:
+        return sql, []
+    pattern = re.compile(
+        r"(?<![@\w])@(" + "|".join(map(re.escape, values)) + r")\b", re.IGNORECASE
+    )
+    names = {name.lower(): name for name in values}
+    params = []
+
+    def replace(match):
+        params.append(values[names[match.group(1).lower()]])
+        return "?"
+
+    # Odd parts are string literals
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for idx in range(0, len(parts), 2):
+        parts[idx] = pattern.sub(replace, parts[idx])
+    return "".join(parts), params
+
+
+# UPDATE of one key value or key range, the form coalesce_statements merges
+RANGE_UPDATE = re.compile(
+    r"UPDATE\s+([\w.\[\]]+)\s+SET\s+(.+?)\s+WHERE\s+([\w\[\]]+)\s+"
+    r"(?:BETWEEN\s+(-?\d+)\s+AND\s+(-?\d+)|=\s*(-?\d+))\s*;?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def coalesce_statements(sql_statements):
+    """Merge consecutive UPDATEs of one table, SET clause and key into one statement.
+
+    Statements of the form "UPDATE t SET ... WHERE key BETWEEN a AND b" (or
+    "key = a") are combined into a single UPDATE matching an inline table of
+    the key ranges, so the table is scanned once instead of once per range.
+    Runs whose ranges overlap are left alone, as a SET referring to its own
+    columns would then be applied a different number of times.
+    """
+    parsed = []
+    for sql in sql_statements:
+        match = RANGE_UPDATE.fullmatch(sql.strip())
+        if match is None or "'" in match.group(2):
+            parsed.append((None, sql))
+            continue
+        table, assignments, key, low, high, value = match.groups()
+        low, high = (int(low), int(high)) if value is None else (int(value),) * 2
+        group = (table.lower(), " ".join(assignments.split()).lower(), key.lower())
+        parsed.append((group, (table, assignments, key, low, high)))
+
+    result = []
+    idx = 0
+    while idx < len(parsed):
+        group, statement = parsed[idx]
+        end = idx + 1
+        while group is not None and end < len(parsed) and parsed[end][0] == group:
+            end += 1
+        run = [statement for _, statement in parsed[idx:end]]
+
+        ranges = sorted((low, high) for _, _, _, low, high in run) if group else []
+        overlapping = any(
+            ranges[i][0] <= ranges[i - 1][1] for i in range(1, len(ranges))
+        )
+        if len(run) == 1 or overlapping:
+            result += [sql_statements[i] for i in range(idx, end)]
+        else:
+            table, assignments, key = run[0][:3]
+            values = ", ".join([f"({low}, {high})" for low, high in ranges])
+            result.append(
+                f"UPDATE {table} SET {' '.join(assignments.split())} "
+                f"WHERE EXISTS (SELECT 1 FROM (VALUES {values}) r(RangeStart, RangeEnd) "
+                f"WHERE {key} BETWEEN r.RangeStart AND r.RangeEnd)"
+            )
+        idx = end
+
+    return result
+
+
+def get_referenced_tables(sql_statements):
+    """Return the table names referenced by FROM, JOIN, UPDATE and INTO clauses."""
+    tables = []
+    for sql in sql_statements:
+        for table in re.findall(
+            r"\b(?:FROM|JOIN|UPDATE|INTO)\s+([\w.\[\]]+)", sql, re.IGNORECASE
+        ):
+            if table not in tables:
+                tables.append(table)
+    return tables
+
+
+def get_written_tables(sql_statements):
+    """Return the tables written by UPDATE, DELETE, INSERT and MERGE statements.
+
+    Aliased UPDATE and DELETE targets are resolved through their FROM clause;
+    #temp tables are left out.
+    """
+    tables = []
+    for sql in sql_statements:
+        target = parse_update_target(sql)
+        match = re.match(
+            r"\s*DELETE\s+(\w+)\s+FROM\s+([\w.\[\]]+)\s+(?:AS\s+)?\1\b",
+            sql,
+            re.IGNORECASE,
+        ) or re.match(
+            r"\s*(?:INSERT|MERGE|DELETE)\s+(?:(?:INTO|FROM)\s+)?()([\w.\[\]#]+)",
+            sql,
+            re.IGNORECASE,
+        )
+        if target is not None:
+            table = target[0]
+        elif match:
+            table = match.group(2)
+        else:
+            continue
+        if not table.startswith("#") and table not in tables:
+            tables.append(table)
+    return tables
+
+
+def normalize_table_name(table):
+    """Return a table reference without brackets and without the dbo schema of
+    two-part names, so the same table is always named alike."""
+    parts = [part.strip("[]") for part in table.split(".")]
+    if len(parts) == 2 and parts[0].lower() == "dbo":
+        parts = parts[1:]
+    return ".".join(parts)
+
+
+def build_upsert(upsert):
+    """Return the MERGE statement of a declarative upsert.
+
+    upsert has the keys
+        target: table written to, may be a three-part name
+        source: table whose rows are upserted, at most one row per key
+        key: column, or list of columns, matching source and target rows
+        update: {column: expression} set on target rows with a source row
+        insert: {column: expression} of new target rows besides the key
+        where: optional condition on the source columns
+    Expressions refer to the target row as t and the source row as s, so a
+    single pass over the source updates existing rows and inserts missing ones.
+    """
+    keys = [upsert["key"]] if isinstance(upsert["key"], str) else list(upsert["key"])
+    source = upsert["source"]
+    if upsert.get("where"):
+        source = f"(SELECT * FROM {source} WHERE {upsert['where']})"
+
+    on = " AND ".join([f"t.[{key}] = s.[{key}]" for key in keys])
+    sql = f"MERGE INTO {upsert['target']} AS t\nUSING {source} AS s\nON {on}"
+    if upsert.get("update"):
+        assignments = ", ".join(
+            [f"t.[{column}] = {value}" for column, value in upsert["update"].items()]
+        )
+        sql += f"\nWHEN MATCHED THEN UPDATE SET {assignments}"
+    if "insert" in upsert:
+        columns = keys + list(upsert["insert"])
+        values = [f"s.[{key}]" for key in keys] + list(upsert["insert"].values())
+        sql += (
+            f"\nWHEN NOT MATCHED BY TARGET THEN INSERT "
+            f"({', '.join([f'[{column}]' for column in columns])}) "
+            f"VALUES ({', '.join(values)})"
+        )
+    # MERGE is the one statement that must be terminated
+    return sql + ";"
+
+
+def prepare_patch(patch_config):
+    """Return a patch definition ready to be run.
+
+    Upserts given as {"upsert": {...}} in sql_statements become MERGE
+    statements, and every table the statements write is added to the
+    declared backup_tables, which may therefore be left out.
+
+    backup_columns maps backup tables to the columns their backup needs
+    besides the primary key. Tables the statements only change by UPDATE
+    get the columns of the SET clauses unless the patch declares them;
+    all other tables are backed up whole.
+    """
+    sql_statements = [
+        build_upsert(sql["upsert"]) if isinstance(sql, dict) else sql
+        for sql in patch_config["sql_statements"]
+    ]
+    backup_tables = list(patch_config.get("backup_tables", []))
+    known = {normalize_table_name(table).lower() for table in backup_tables}
+    for table in get_written_tables(sql_statements):
+        table = normalize_table_name(table)
+        if table.lower() not in known:
+            known.add(table.lower())
+            backup_tables.append(table)
+
+    # None marks tables written by statements other than a parsable UPDATE
+    set_columns = {}
+    for sql in sql_statements:
+        for table in get_written_tables([sql]):
+            key = normalize_table_name(table).lower()
+            columns = parse_set_columns(sql)
+            if columns is None or set_columns.get(key, []) is None:
+                set_columns[key] = None
+                continue
+            current = set_columns.setdefault(key, [])
+            lowered = [column.lower() for column in current]
+            current += [column for column in columns if column.lower() not in lowered]
+    declared = {
+        normalize_table_name(table).lower(): columns
+        for table, columns in patch_config.get("backup_columns", {}).items()
+    }
+    backup_columns = {}
+    for table in backup_tables:
+        key = normalize_table_name(table).lower()
+        columns = declared.get(key, set_columns.get(key))
+        if columns:
+            backup_columns[table] = list(columns)
+
+    return dict(
+        patch_config,
+        sql_statements=sql_statements,
+        backup_tables=backup_tables,
+        backup_columns=backup_columns,
+    )
+
+
+def strip_schema(table):
+    """Return the bare table name of a (possibly schema-qualified) table reference."""
+    return table.split(".")[-1].strip("[]")
+
+
+def split_table_name(table):
+    """Return (database, bare name) of a table reference.
+
+    database is "" unless the reference is a three-part name such as
+    SRO_VT_ACCOUNT.dbo.SK_Silk.
+    """
+    parts = [part.strip("[]") for part in table.split(".")]
+    return (parts[0], parts[-1]) if len(parts) == 3 else ("", parts[-1])
+
+
+def group_tables_by_database(tables):
+    """Return {database: tables} with "" for tables of the current database."""
+    groups = {}
+    for table in tables:
+        groups.setdefault(split_table_name(table)[0], []).append(table)
+    return groups
+
+
+def rename_table(cursor, table, new_name):
+    """Rename a table, which may be in another database, to the bare new_name."""
+    # sp_rename works in the database of the table and takes a bare new name
+    database, _ = split_table_name(table)
+    procedure = f"[{database}].sys.sp_rename" if database else "sp_rename"
+    local_table = table.split(".", 1)[1] if database else table
+    cursor.execute(f"EXEC {procedure} '{local_table}', '{strip_schema(new_name)}'")
+
+
+def get_row_checksum(columns):
+    """Return a per-row content hash of columns of t for incremental backups."""
+    column_list = ", ".join([f"t.[{col}]" for col in columns])
+    return f"HASHBYTES('SHA2_256', (SELECT {column_list} FOR XML RAW, BINARY BASE64))"
+
+
+def drop_backup_tables(cursor, catalog, table):
+    """Drop <table>_Backup together with its incremental delta chain."""
+    for suffix in catalog.BACKUP_SUFFIXES:
+        backup_table = catalog.backup_name(table, suffix)
+        cursor.execute(f"""
+            IF OBJECT_ID('{backup_table}', 'U') IS NOT NULL
+                DROP TABLE {backup_table}
+        """)
+
+
+# Editions without data compression (Standard and Express before 2016 SP1)
+# reject it with error 7738
+COMPRESSION_ERROR_PATTERN = re.compile(
+    r"\bMsg 7738\b|Only SQL Server Enterprise Edition supports compression"
+    r"|compression is not (?:available|supported)",
+    re.IGNORECASE,
+)
+COMPRESSION_NOTE = (
+    "Data compression is not supported by this SQL Server edition; "
+    "backups are stored uncompressed"
+)
+
+
+def copy_to_new_table(cursor, source, target, like, compression="NONE", columns=None):
+    """Copy the rows of source into a new heap target with the columns of like.
+
+    The empty table is created first, without IDENTITY properties, so it can
+    be compressed before the rows are loaded with TABLOCK. That load is
+    minimally logged when the database of target uses the simple or
+    bulk-logged recovery model, e.g. a dedicated backup database.
+    With columns given, only those columns are copied.
+    Returns the compression used, which is "NONE" if the server edition
+    does not support the one asked for.
+    """
+    t_columns = ", ".join([f"t.[{col}]" for col in columns]) if columns else "t.*"
+    b_columns = ", ".join([f"b.[{col}]" for col in columns]) if columns else "*"
+    cursor.execute(f"""
+        SELECT TOP (0) {t_columns}
+        INTO {target}
+        FROM (SELECT 1 AS Dummy) d
+        LEFT JOIN {like} t ON 1 = 0
+    """)
+    if compression.upper() != "NONE":
+        try:
+            cursor.execute(
+                f"ALTER TABLE {target} REBUILD WITH (DATA_COMPRESSION = {compression})"
+            )
+        except Exception as e:
+            if not COMPRESSION_ERROR_PATTERN.search(str(e)):
+                raise
+            compression = "NONE"
+    cursor.execute(f"""
+        INSERT INTO {target} WITH (TABLOCK)
+        SELECT {b_columns}
+        FROM {source} b
+    """)
+    return compression
+
+
+def create_full_backup(cursor, catalog, table, compression="NONE", columns=None):
+    """Copy table into <table>_Backup, discarding any incremental delta chain.
+
+    With columns given, as returned by resolve_backup_columns, only those
+    columns are copied. Returns the compression used, see copy_to_new_table.
+    """
+    drop_backup_tables(cursor, catalog, table)
+    return copy_to_new_table(
+        cursor, table, catalog.backup_name(table), table, compression, columns
+    )
+
+
+def resolve_backup_columns(catalog, table, columns):
+    """Return the primary key and the given columns of table in column order.
+
+    Returns None if the whole table has to be backed up: no columns are
+    given, the table has no primary key to restore rows by, or the columns
+    cover the whole table. Raises on columns the table does not have.
+    """
+    all_columns = catalog.columns(table)
+    pk_columns = catalog.primary_key(table)
+    if not columns or not all_columns:
+        return None
+    names = [col.lower() for col in all_columns]
+    unknown = [col for col in columns if col.strip("[]").lower() not in names]
+    if unknown:
+        raise Exception(f"{table} has no column {', '.join(unknown)} to back up!")
+    wanted = {col.strip("[]").lower() for col in columns + pk_columns}
+    if not pk_columns or len(wanted) == len(all_columns):
+        return None
+    return [col for col in all_columns if col.lower() in wanted]
+
+
+def get_backup_columns(catalog, table, backup_table=None):
+    """Return the columns of table held by a backup, by default <table>_Backup.
+
+    These are all columns for a full backup and the primary key plus the
+    backed-up columns for a column backup.
+    """
+    held = {
+        col.lower()
+        for col in catalog.columns(backup_table or catalog.backup_name(table))
+    }
+    return [col for col in catalog.columns(table) if col.lower() in held]
+
+
+# Marker in the header line of exported backup files
+EXPORT_FORMAT = "srodbpatch-export"
+
+
+def get_export_path(directory, table):
+    """Return the path of the exported backup file of table in directory."""
+    return os.path.join(directory, f"{strip_schema(table)}.jsonl.gz")
+
+
+def encode_value(value):
+    """Return a JSON-serializable form of a column value."""
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, dtime):
+        return {"$time": value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {"$uuid": str(value)}
+    return value
+
+
+def decode_value(value):
+    """Turn a value written by encode_value back into a column value."""
+    if not isinstance(value, dict):
+        return value
+    ((kind, text),) = value.items()
+    if kind == "$bytes":
+        return base64.b64decode(text)
+    if kind == "$decimal":
+        return Decimal(text)
+    if kind == "$datetime":
+        return datetime.fromisoformat(text)
+    if kind == "$date":
+        return date.fromisoformat(text)
+    if kind == "$time":
+        return dtime.fromisoformat(text)
+    if kind == "$uuid":
+        return uuid.UUID(text)
+    raise ValueError(f"Unknown value type in export file: {kind}")
+
+
+def get_backup_source(catalog, table):
+    """Return a FROM-clause source holding the latest backed-up state of table.
+
+    Without incremental backups this is simply <table>_Backup. Otherwise the
+    delta chain is replayed on top of the base backup: rows touched by any
+    delta are taken from their newest delta entry, deleted rows are dropped.
+    The deltas of a column backup hold the same columns as its base.
+    """
+    backup_table = catalog.backup_name(table)
+    delta_table = catalog.backup_name(table, "_Backup_Delta")
+    pk_columns = catalog.primary_key(table)
+    if not pk_columns or not catalog.exists(delta_table):
+        return backup_table
+
+    pk_match = " AND ".join([f"d.[{col}] = b.[{col}]" for col in pk_columns])
+    latest_match = " AND ".join([f"d2.[{col}] = d.[{col}]" for col in pk_columns])
+    column_list = ", ".join(
+        [f"d.[{col}]" for col in get_backup_columns(catalog, table)]
+    )
+    return f"""(
+        SELECT b.*
+        FROM {backup_table} b
+        WHERE NOT EXISTS (SELECT 1 FROM {delta_table} d WHERE {pk_match})
+        UNION ALL
+        SELECT {column_list}
+        FROM {delta_table} d
+        WHERE d.DeltaOp <> 'D'
+        AND d.DeltaSeq = (
+            SELECT MAX(d2.DeltaSeq) FROM {delta_table} d2 WHERE {latest_match}
+        )
+    )"""
+
+
+def get_row_counts(cursor, tables):
+    """Return {table: row count} from sys.dm_db_partition_stats.
+
+    Counts come from metadata, so they are cheap but approximate. Tables of
+    a database whose view cannot be read count as 0.
+    """
+    counts = {}
+    for database, names in group_tables_by_database(tables).items():
+        prefix = f"[{database}]." if database else ""
+        values = ", ".join(["('" + name.replace("'", "''") + "')" for name in names])
+        try:
+            cursor.execute(f"""
+                SELECT v.name, ISNULL(SUM(p.row_count), 0)
+                FROM (VALUES {values}) v(name)
+                LEFT JOIN {prefix}sys.dm_db_partition_stats p
+                    ON p.object_id = OBJECT_ID(v.name)
+                    AND p.index_id IN (0, 1)
+                GROUP BY v.name
+            """)
+            counts.update({name: int(count) for name, count in cursor.fetchall()})
+        except Exception:
+            counts.update({name: 0 for name in names})
+    return counts
+
+
+# SQL Server errors worth retrying: lock request timeout (1222) and deadlock
+# victim (1205). They are recognized by their message text or a "Msg <number>"
+# prefix, never by a bare number, which may be part of a key value.
+LOCK_ERRORS = {
+    1222: "lock timeout",
+    1205: "deadlock",
+}
+LOCK_ERROR_PATTERN = re.compile(
+    r"\bMsg (1222|1205)\b|Lock request time out|deadlocked on lock", re.IGNORECASE
+)
+
+
+def get_lock_error(error):
+    """Return "lock timeout" or "deadlock" if error is one of LOCK_ERRORS, else None."""
+    match = LOCK_ERROR_PATTERN.search(str(error))
+    if match is None:
+        return None
+    if match.group(1):
+        return LOCK_ERRORS[int(match.group(1))]
+    return "deadlock" if "deadlock" in match.group(0).lower() else "lock timeout"
+
+
+def get_table_sizes(cursor, tables):
+    """Return {table: (rows, bytes)} of tables from metadata.
+
+    Without VIEW DATABASE STATE rows are counted with COUNT(*) and sizes are
+    reported as 0, so only size-based retention is affected.
+    """
+    sizes = {}
+    for database, names in group_tables_by_database(tables).items():
+        prefix = f"[{database}]." if database else ""
+        values = ", ".join(["('" + name.replace("'", "''") + "')" for name in names])
+        try:
+            cursor.execute(f"""
+                SELECT v.name, ISNULL(SUM(CASE WHEN p.index_id IN (0, 1) THEN p.row_count END), 0),
+                       ISNULL(SUM(p.used_page_count), 0) * 8192
+                FROM (VALUES {values}) v(name)
+                LEFT JOIN {prefix}sys.dm_db_partition_stats p
+                    ON p.object_id = OBJECT_ID(v.name)
+                GROUP BY v.name
+            """)
+            sizes.update(
+                {name: (int(rows), int(size)) for name, rows, size in cursor.fetchall()}
+            )
+        except Exception:
+            for name in names:
+                cursor.execute(f"SELECT COUNT(*) FROM {name}")
+                sizes[name] = (int(cursor.fetchone()[0]), 0)
+    return sizes
+
+
+# Column types BINARY_CHECKSUM cannot hash; they are left out of verification
+UNHASHABLE_TYPES = {
+    "text",
+    "ntext",
+    "image",
+    "xml",
+    "sql_variant",
+    "geography",
+    "geometry",
+    "hierarchyid",
+}
+
+# Key types whose values can be split into numeric ranges
+INTEGER_TYPES = {"tinyint", "smallint", "int", "bigint"}
+
+
+def get_range_checksums(cursor, sources, row_hash, bucket):
+    """Return {(side, bucket): (rows, CHECKSUM_AGG, checksum sum)} per source.
+
+    sources are (FROM-clause source, WHERE condition) pairs hashed in one
+    round trip; the sum guards against pairs of equal rows cancelling out in
+    CHECKSUM_AGG.
+    """
+    selects = " UNION ALL ".join(
+        [
+            f"SELECT {side} AS Side, {bucket} AS Bucket, {row_hash} AS RowHash "
+            f"FROM {source} t WHERE {condition}"
+            for side, (source, condition) in enumerate(sources)
+        ]
+    )
+    cursor.execute(f"""
+        SELECT s.Side, s.Bucket, COUNT(*), CHECKSUM_AGG(s.RowHash),
+               SUM(CAST(s.RowHash AS bigint))
+        FROM ({selects}) s
+        GROUP BY s.Side, s.Bucket
+    """)
+    return {(side, bucket): tuple(rest) for side, bucket, *rest in cursor.fetchall()}
+
+
+def compare_table_checksums(
+    cursor,
+    catalog,
+    table,
+    source,
+    other,
+    ranges=16,
+    min_range=100,
+    max_ranges=32,
+    columns=None,
+):
+    """Compare the contents of two sources with the columns of table.
+
+    Rows are hashed with BINARY_CHECKSUM and aggregated on the server per key
+    range, so no rows are transferred and the comparison is independent of
+    row order. With a single-column integer primary key, ranges that differ
+    are split again into ranges buckets until they span at most min_range
+    keys, or more than max_ranges ranges differ.
+
+    Returns the differing (low key, high key) ranges merged where adjacent,
+    [] if the contents match, or [(None, None)] if the table has no integer
+    key and differs somewhere. columns restricts the comparison to some
+    columns of table, e.g. those of a column backup.
+    """
+    info = catalog.get(table)
+    columns = [
+        col
+        for col in columns or catalog.columns(table)
+        if info.types.get(col, "").lower() not in UNHASHABLE_TYPES
+    ]
+    row_hash = "BINARY_CHECKSUM(" + ", ".join([f"t.[{col}]" for col in columns]) + ")"
+    pk_columns = catalog.primary_key(table)
+    if len(pk_columns) != 1 or info.types[pk_columns[0]].lower() not in INTEGER_TYPES:
+        sums = get_range_checksums(
+            cursor, [(source, "1 = 1"), (other, "1 = 1")], row_hash, "0"
+        )
+        return [] if sums.get((0, 0)) == sums.get((1, 0)) else [(None, None)]
+
+    key = f"t.[{pk_columns[0]}]"
+    bounds = []
+    for side in (source, other):
+        cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM {side} t")
+        bounds.extend(value for value in cursor.fetchone() if value is not None)
+    if not bounds:
+        return []
+
+    differing = []
+    pending = [(int(min(bounds)), int(max(bounds)))]
+    while pending:
+        split = []
+        for low, high in pending:
+            width = (high - low) // ranges + 1
+            condition = f"{key} BETWEEN {low} AND {high}"
+            sums = get_range_checksums(
+                cursor,
+                [(source, condition), (other, condition)],
+                row_hash,
+                f"({key} - {low}) / {width}",
+            )
+            for bucket in sorted({bucket for _, bucket in sums}):
+                if sums.get((0, bucket)) == sums.get((1, bucket)):
+                    continue
+                start = low + bucket * width
+                end = min(high, start + width - 1)
+                if end - start < min_range:
+                    differing.append((start, end))
+                else:
+                    split.append((start, end))
+        if len(differing) + len(split) > max_ranges:
+            differing.extend(split)
+            break
+        pending = split
+
+    merged = []
+    for start, end in sorted(differing):
+        if merged and start == merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_key_ranges(catalog, table, ranges):
+    """Return a readable list of the key ranges compare_table_checksums found."""
+    if ranges == [(None, None)]:
+        return "somewhere (no integer key to narrow it down)"
+    key = catalog.primary_key(table)[0]
+    return ", ".join(
+        [
+            f"{key} {start}" if start == end else f"{key} {start}-{end}"
+            for start, end in ranges
+        ]
+    )
+
+
+def get_foreign_key_references(cursor, tables):
+    """Return (child, parent) pairs for foreign keys between the given tables."""
+    # Foreign keys are only looked up in the current database
+    names = {
+        strip_schema(table): table for table in tables if not split_table_name(table)[0]
+    }
+    if not names:
+        return []
+    name_list = ", ".join([f"'{name}'" for name in names])
+    cursor.execute(f"""
+        SELECT OBJECT_NAME(parent_object_id), OBJECT_NAME(referenced_object_id)
+        FROM sys.foreign_keys
+        WHERE OBJECT_NAME(parent_object_id) IN ({name_list})
+        AND OBJECT_NAME(referenced_object_id) IN ({name_list})
+        AND parent_object_id <> referenced_object_id
+    """)
+    return [(names[child], names[parent]) for child, parent in cursor.fetchall()]
+
+
+def group_tables_by_foreign_keys(tables, references):
+    """Split tables into groups that share no foreign keys with each other.
+
+    Each group is ordered parents first, so groups can be processed
+    independently and tables within a group in foreign-key-safe order.
+    """
+    group_of = {table: {table} for table in tables}
+    for child, parent in references:
+        if group_of[child] is not group_of[parent]:
+            merged = group_of[child] | group_of[parent]
+            for table in merged:
+                group_of[table] = merged
+
+    parents = {table: set() for table in tables}
+    for child, parent in references:
+        parents[child].add(parent)
+
+    groups = []
+    seen = set()
+    for table in tables:
+        if table in seen:
+            continue
+        members = [t for t in tables if t in group_of[table]]
+        seen.update(members)
+
+        ordered = []
+        remaining = list(members)
+        while remaining:
+            ready = [t for t in remaining if parents[t] <= set(ordered)]
+            if not ready:
+                # Circular references - keep the configured order for the rest
+                ready = remaining
+            for t in ready:
+                ordered.append(t)
+                remaining.remove(t)
+        groups.append(ordered)
+
+    return groups
+
+
+class TableInfo:
+    """Schema details of one table as loaded by SchemaCatalog."""
+
+    def __init__(self, object_id, modify_date):
+        self.object_id = object_id
+        self.modify_date = modify_date
+        self.columns = []
+        self.types = {}
+        self.primary_key = []
+        self.indexes = {}
+
+
+class SchemaCatalog:
+    """Cache of table schema details for one connection target.
+
+    Entries are revalidated against sys.objects on every refresh, so DDL such
+    as a recreated backup table or an altered column invalidates them.
+    """
+
+    BACKUP_SUFFIXES = ("_Backup", "_Backup_Delta", "_Backup_Checksum")
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+        # Database of the connection and where its backups are kept, see
+        # backup_name
+        self.database = ""
+        self.backup_database = ""
+        self.backup_schema = ""
+
+    @staticmethod
+    def key(table):
+        """Return the cache key of a table: (database, schema, name).
+
+        database is "" for the current one and schema "" for dbo or none.
+        """
+        parts = [part.strip("[]") for part in table.split(".")]
+        database = parts[0] if len(parts) == 3 else ""
+        schema = parts[-2] if len(parts) > 1 else ""
+        return database, "" if schema.lower() == "dbo" else schema, parts[-1]
+
+    def backup_name(self, table, suffix="_Backup"):
+        """Return the name of a backup table of table, by default <table>_Backup.
+
+        With a backup database or schema configured, backups are kept there
+        instead of next to the table. Their names are then prefixed with the
+        database of the table, so several databases can share one target.
+        """
+        if not self.backup_database and not self.backup_schema:
+            return f"{table}{suffix}"
+        database, name = split_table_name(table)
+        if self.backup_database:
+            database = database or self.database
+        if database:
+            name = f"{database}_{name}"
+        prefix = f"{self.backup_database}." if self.backup_database else ""
+        return f"{prefix}{self.backup_schema or 'dbo'}.{name}{suffix}"
+
+    def refresh(self, cursor, tables, backups=True):
+        """Make sure the cached details of tables and their backups are current.
+
+        With backups unset only the tables themselves are refreshed, e.g. for
+        backup generations that are tables of their own.
+        """
+        groups = {}
+        for table in tables:
+            references = [table]
+            if backups:
+                references += [
+                    self.backup_name(table, suffix) for suffix in self.BACKUP_SUFFIXES
+                ]
+            for reference in references:
+                database, schema, name = self.key(reference)
+                groups.setdefault((database, schema), set()).add(name)
+
+        for (database, schema), names in groups.items():
+            self._refresh_group(cursor, database, schema, sorted(names))
+
+    @staticmethod
+    def _schema_filter(prefix, schema, column="schema_id"):
+        """Return a condition restricting objects to schema, or "" for any."""
+        if not schema:
+            return ""
+        return (
+            f"AND {column} = "
+            f"(SELECT schema_id FROM {prefix}sys.schemas WHERE name = '{schema}')"
+        )
+
+    def _refresh_group(self, cursor, database, schema, names):
+        """Refresh the cached tables of one database and schema."""
+        prefix = f"[{database}]." if database else ""
+        name_list = ", ".join([f"'{name}'" for name in names])
+        cursor.execute(f"""
+            SELECT name, object_id, modify_date
+            FROM {prefix}sys.objects
+            WHERE type = 'U' AND name IN ({name_list})
+            {self._schema_filter(prefix, schema)}
+        """)
+        current = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        stale = []
+        with self._lock:
+            for name in names:
+                key = (database, schema, name)
+                info = self._tables.get(key)
+                if name not in current:
+                    self._tables[key] = None
+                elif (
+                    info is None or (info.object_id, info.modify_date) != current[name]
+                ):
+                    stale.append(name)
+
+        if stale:
+            self._load(cursor, database, schema, stale, current)
+
+    def _load(self, cursor, database, schema, names, current):
+        """Load columns, types, primary keys and indexes of tables in one round trip."""
+        prefix = f"[{database}]." if database else ""
+        name_list = ", ".join([f"'{name}'" for name in names])
+        schema_filter = self._schema_filter(prefix, schema, "o.schema_id")
+        cursor.execute(f"""
+            SELECT o.name, 'C', c.name, TYPE_NAME(c.user_type_id),
+                   c.column_id, CAST(ISNULL(pk.key_ordinal, 0) AS int)
+            FROM {prefix}sys.objects o
+            INNER JOIN {prefix}sys.columns c ON c.object_id = o.object_id
+            LEFT JOIN (
+                SELECT ic.object_id, ic.column_id, ic.key_ordinal
+                FROM {prefix}sys.indexes i
+                INNER JOIN {prefix}sys.index_columns ic
+                    ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                WHERE i.is_primary_key = 1
+            ) pk ON pk.object_id = o.object_id AND pk.column_id = c.column_id
+            WHERE o.type = 'U' AND o.name IN ({name_list}) {schema_filter}
+            UNION ALL
+            SELECT o.name, 'I', i.name, ci.name,
+                   CAST(ic.key_ordinal AS int), CAST(i.is_unique AS int)
+            FROM {prefix}sys.objects o
+            INNER JOIN {prefix}sys.indexes i ON i.object_id = o.object_id
+            INNER JOIN {prefix}sys.index_columns ic
+                ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+            INNER JOIN {prefix}sys.columns ci
+                ON ci.object_id = ic.object_id AND ci.column_id = ic.column_id
+            WHERE o.type = 'U' AND o.name IN ({name_list}) {schema_filter}
+            AND ic.key_ordinal > 0
+        """)
+
+        loaded = {name: TableInfo(*current[name]) for name in names}
+        columns = {name: [] for name in names}
+        primary_keys = {name: [] for name in names}
+        for table, kind, name, type_name, ordinal, flag in cursor.fetchall():
+            info = loaded[table]
+            if kind == "C":
+                columns[table].append((ordinal, name))
+                info.types[name] = type_name
+                if flag:
+                    primary_keys[table].append((flag, name))
+            else:
+                info.indexes.setdefault(name, []).append((ordinal, type_name))
+
+        for table, info in loaded.items():
+            info.columns = [name for _, name in sorted(columns[table])]
+            info.primary_key = [name for _, name in sorted(primary_keys[table])]
+            info.indexes = {
+                index: [column for _, column in sorted(index_columns)]
+                for index, index_columns in info.indexes.items()
+            }
+
+        with self._lock:
+            for name, info in loaded.items():
+                self._tables[(database, schema, name)] = info
+
+    def get(self, table):
+        """Return the TableInfo of a table, or None if it does not exist."""
+        with self._lock:
+            return self._tables.get(self.key(table))
+
+    def exists(self, table):
+        """Return True if the table existed at the last refresh."""
+        return self.get(table) is not None
+
+    def columns(self, table):
+        """Return all column names of a table in ordinal order."""
+        info = self.get(table)
+        return list(info.columns) if info else []
+
+    def primary_key(self, table):
+        """Return the primary key column names of a table in key order."""
+        info = self.get(table)
+        return list(info.primary_key) if info else []
+
+
+class BackupStore:
+    """Catalog of backup generations of one connection target.
+
+    <table>_Backup always holds the current generation. Before a new full
+    backup replaces it, it is kept as <table>_Backup_<generation> and stays
+    listed in CATALOG_TABLE with its size, row count and source patch.
+    Older generations are evicted oldest first once there are more than
+    keep of them or they take more than max_bytes per table (0 = unlimited).
+    Full backups are stored with the given data compression; if the server
+    edition does not support it, they are stored uncompressed from then on
+    and compression_unsupported is set.
+    """
+
+    CATALOG_TABLE = "_BackupCatalog"
+
+    def __init__(self, keep=0, max_bytes=0, compression="NONE"):
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.compression_unsupported = False
+
+    def note_compression(self, used):
+        """Stop compressing backups once the server turned compression down."""
+        if used != self.compression:
+            self.compression = "NONE"
+            self.compression_unsupported = True
+
+    # Last label handed out and how often, see new_generation
+    _last_generation = ("", 0)
+    _generation_lock = threading.Lock()
+
+    @classmethod
+    def new_generation(cls):
+        """Return the label of a generation created now.
+
+        Labels are unique within the process; a second generation created
+        in the same second gets a -2 suffix, and so on.
+        """
+        label = datetime.now().strftime("%Y%m%d-%H%M%S")
+        with cls._generation_lock:
+            last, count = cls._last_generation
+            count = count + 1 if label == last else 1
+            cls._last_generation = (label, count)
+        return label if count == 1 else f"{label}-{count}"
+
+    def ensure_catalog(self, cursor):
+        """Create the catalog table if it does not exist yet."""
+        cursor.execute(f"""
+            IF OBJECT_ID('{self.CATALOG_TABLE}', 'U') IS NULL
+                CREATE TABLE {self.CATALOG_TABLE} (
+                    TableName nvarchar(128) NOT NULL,
+                    Generation varchar(32) NOT NULL,
+                    BackupTable nvarchar(128) NOT NULL,
+                    CreatedAt datetime2 NOT NULL,
+                    BackupRows bigint NOT NULL,
+                    SizeBytes bigint NOT NULL,
+                    SourcePatch nvarchar(256) NULL,
+                    PRIMARY KEY (TableName, Generation)
+                )
+        """)
+
+    def generations(self, cursor, table):
+        """Return the generations of table as dicts, newest first."""
+        cursor.execute(f"SELECT OBJECT_ID('{self.CATALOG_TABLE}', 'U')")
+        if cursor.fetchone()[0] is None:
+            return []
+        cursor.execute(
+            f"""
+            SELECT Generation, BackupTable, CreatedAt, BackupRows, SizeBytes, SourcePatch
+            FROM {self.CATALOG_TABLE}
+            WHERE TableName = ?
+            ORDER BY CreatedAt DESC, Generation DESC
+            """,
+            table,
+        )
+        keys = ("generation", "backup_table", "created", "rows", "bytes", "source")
+        return [dict(zip(keys, row)) for row in cursor.fetchall()]
+
+    def find(self, cursor, table, generation):
+        """Return the backup table holding a generation of table, or None."""
+        cursor.execute(
+            f"""
+            SELECT BackupTable FROM {self.CATALOG_TABLE}
+            WHERE TableName = ? AND Generation = ?
+            """,
+            table,
+            generation,
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def archive_current(self, cursor, catalog, table, generation):
+        """Keep the current <table>_Backup as an older generation.
+
+        generation labels the new backup about to replace it. A current backup
+        with a delta chain is materialized, otherwise the table is renamed.
+        """
+        backup_table = catalog.backup_name(table)
+        if not catalog.exists(backup_table):
+            return
+        cursor.execute(
+            f"""
+            SELECT Generation FROM {self.CATALOG_TABLE}
+            WHERE TableName = ? AND BackupTable = ?
+            """,
+            table,
+            backup_table,
+        )
+        row = cursor.fetchone()
+        # Backups made before the catalog existed are labelled after the new one
+        current = row[0] if row else f"{generation}-previous"
+        archive_table = catalog.backup_name(
+            table, f"_Backup_{re.sub(r'[^0-9A-Za-z]', '_', current)}"
+        )
+
+        if catalog.exists(catalog.backup_name(table, "_Backup_Delta")):
+            used = copy_to_new_table(
+                cursor,
+                get_backup_source(catalog, table),
+                archive_table,
+                table,
+                self.compression,
+                get_backup_columns(catalog, table),
+            )
+            self.note_compression(used)
+        else:
+            rename_table(cursor, backup_table, archive_table)
+
+        if row:
+            cursor.execute(
+                f"""
+                UPDATE {self.CATALOG_TABLE} SET BackupTable = ?
+                WHERE TableName = ? AND Generation = ?
+                """,
+                archive_table,
+                table,
+                current,
+            )
+        else:
+            self.record(cursor, table, current, archive_table, None)
+
+    def record(self, cursor, table, generation, backup_table, source):
+        """Add a generation stored in backup_table to the catalog."""
+        rows, size = get_table_sizes(cursor, [backup_table])[backup_table]
+        cursor.execute(
+            f"""
+            INSERT INTO {self.CATALOG_TABLE}
+                (TableName, Generation, BackupTable, CreatedAt, BackupRows,
+                 SizeBytes, SourcePatch)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            table,
+            generation,
+            backup_table,
+            datetime.now(),
+            rows,
+            size,
+            source,
+        )
+
+    def apply_retention(self, cursor, catalog, table):
+        """Evict the oldest generations of table beyond the retention policy.
+
+        Returns the evicted generation labels.
+        """
+        if not self.keep and not self.max_bytes:
+            return []
+        generations = self.generations(cursor, table)
+        evicted = []
+        total = sum(generation["bytes"] for generation in generations)
+        while len(generations) > 1 and (
+            (self.keep and len(generations) > self.keep)
+            or (self.max_bytes and total > self.max_bytes)
+        ):
+            oldest = generations.pop()
+            if oldest["backup_table"] == catalog.backup_name(table):
+                break
+            cursor.execute(f"""
+                IF OBJECT_ID('{oldest["backup_table"]}', 'U') IS NOT NULL
+                    DROP TABLE {oldest["backup_table"]}
+            """)
+            cursor.execute(
+                f"""
+                DELETE FROM {self.CATALOG_TABLE}
+                WHERE TableName = ? AND Generation = ?
+                """,
+                table,
+                oldest["generation"],
+            )
+            total -= oldest["bytes"]
+            evicted.append(oldest["generation"])
+        return evicted
+
+    def create_generation(
+        self, cursor, catalog, table, generation, source=None, columns=None
+    ):
+        """Take a full backup of table as a new current generation.
+
+        The previous backup is archived and retention is applied afterwards.
+        With columns given, only those columns are backed up.
+        Returns the evicted generation labels.
+        """
+        self.ensure_catalog(cursor)
+        self.archive_current(cursor, catalog, table, generation)
+        self.note_compression(
+            create_full_backup(cursor, catalog, table, self.compression, columns)
+        )
+        self.record(cursor, table, generation, catalog.backup_name(table), source)
+        return self.apply_retention(cursor, catalog, table)
+
+
+class ConnectionPool:
+    """Thread-safe pool of open connections to one database.
+
+    Idle connections are validated with a cheap round trip before they are
+    handed out, so a dropped session is replaced instead of failing the caller.
+    connect(connection_string) opens new connections; it defaults to
+    mssql_python.connect and can be replaced by a compatible driver.
+    """
+
+    def __init__(self, connection_string, max_idle=4, connect=None):
+        self.connection_string = connection_string
+        self.max_idle = max_idle
+        self.connect = connect
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.catalog = SchemaCatalog()
+        self.backups = BackupStore()
+        # Session lock timeout in ms (-1 = wait forever) and retries of a unit
+        # of work that failed on a lock timeout or deadlock
+        self.lock_timeout = -1
+        self.lock_retries = 0
+        # Dry-run results per patch, see EstimateJob
+        self.estimates = {}
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Return a healthy connection, reusing an idle one when possible."""
+        if self.connect is None:
+            # Imported lazily so commands that never connect start instantly
+            import mssql_python
+
+            self.connect = mssql_python.connect
+
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self.connect(self.connection_string)
+            if self._is_healthy(conn):
+                return conn
+            self._close_quietly(conn)
+
+    def release(self, conn):
+        """Roll back any open transaction and return the connection to the pool."""
+        try:
+            conn.rollback()
+        except Exception:
+            self._close_quietly(conn)
+            return
+
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that acquires a connection and releases it afterwards."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections; connections in use are closed on release."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+def create_pool(config):
+    """Return a ConnectionPool for a configuration, with its backup retention."""
+    pool = ConnectionPool(get_connection_string(config))
+    pool.catalog.database = config.get("database", "")
+    pool.catalog.backup_database = config.get("backup_database", "")
+    pool.catalog.backup_schema = config.get("backup_schema", "")
+    pool.backups.compression = config.get("backup_compression", "NONE")
+    pool.backups.keep = config.get("backup_keep", DEFAULT_CONFIG["backup_keep"])
+    pool.backups.max_bytes = int(config.get("backup_max_gb", 0) * 1024**3)
+    pool.lock_timeout = config.get("lock_timeout_ms", -1)
+    pool.lock_retries = config.get("lock_retries", 0)
+    return pool
+
+
+def run_table_groups(
+    pool, groups, process_group, workers, open_cursor=None, run_unit=None
+):
+    """Run process_group(cursor, group) for each group concurrently.
+
+    Every group gets its own connection and transaction. All transactions are
+    committed once every group succeeded, otherwise all of them are rolled back.
+    open_cursor(conn) creates the cursor for a group, conn.cursor() by default.
+    run_unit(conn, unit, label), if given, runs each group, e.g. to retry it.
+    Returns the results of process_group in group order.
+    """
+    if open_cursor is None:
+        open_cursor = lambda conn: conn.cursor()  # noqa: E731
+    if run_unit is None:
+        run_unit = lambda conn, unit, label: unit()  # noqa: E731
+
+    connections = []
+    lock = threading.Lock()
+
+    def run_group(group):
+        conn = pool.acquire()
+        with lock:
+            connections.append(conn)
+        cursor = open_cursor(conn)
+        return run_unit(conn, lambda: process_group(cursor, group), ", ".join(group))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_group, group) for group in groups]
+        results = [future.result() for future in futures]
+
+        for conn in connections:
+            conn.commit()
+        return results
+    finally:
+        # Releasing rolls back whatever was not committed above
+        for conn in connections:
+            pool.release(conn)
+
+
+class ThrottleGovernor:
+    """Adapt batch size and pauses to server pressure between units of work.
+
+    Pressure is sampled from sys.dm_os_wait_stats deltas - the average wait
+    of log flushes (WRITELOG) and of lock and page I/O waits - and from the
+    sessions in sys.dm_exec_requests that this session blocks. While a wait
+    average exceeds latency_ms or anything is blocked, the batch size is
+    halved and the pause between units doubled; well under the budget both
+    recover. Sampling needs VIEW SERVER STATE; without it nothing is throttled.
+    """
+
+    MIN_BATCH_SIZE = 100
+    MIN_PAUSE = 0.1
+    MAX_PAUSE = 30.0
+
+    def __init__(self, latency_ms, batch_size):
+        self.latency_ms = latency_ms
+        self.batch_size = batch_size
+        self.max_batch_size = batch_size
+        self.pause = 0.0
+        self.enabled = True
+        self.slowdowns = 0
+        self.paused_seconds = 0.0
+        self._last = None
+
+    def sample(self, cursor):
+        """Return the cumulative (log wait ms, log waits, other wait ms, other
+        waits) counters and the number of sessions blocked by this session."""
+        cursor.execute("""
+            SELECT
+                SUM(CASE WHEN wait_type = 'WRITELOG' THEN wait_time_ms END),
+                SUM(CASE WHEN wait_type = 'WRITELOG' THEN waiting_tasks_count END),
+                SUM(CASE WHEN wait_type <> 'WRITELOG' THEN wait_time_ms END),
+                SUM(CASE WHEN wait_type <> 'WRITELOG' THEN waiting_tasks_count END),
+                (SELECT COUNT(*) FROM sys.dm_exec_requests
+                 WHERE blocking_session_id = @@SPID)
+            FROM sys.dm_os_wait_stats
+            WHERE wait_type = 'WRITELOG'
+            OR wait_type LIKE 'LCK[_]M[_]%'
+            OR wait_type LIKE 'PAGEIOLATCH[_]%'
+        """)
+        row = cursor.fetchone()
+        return tuple(int(value or 0) for value in row[:4]), int(row[4] or 0)
+
+    def measure(self, cursor):
+        """Return (log wait ms, other wait ms, blocked sessions) since the last
+        call, or None if there is no previous sample or sampling failed."""
+        if not self.enabled:
+            return None
+        try:
+            counters, blocked = self.sample(cursor)
+        except Exception:
+            self.enabled = False
+            return None
+        last, self._last = self._last, counters
+        if last is None:
+            return None
+        deltas = [current - previous for current, previous in zip(counters, last)]
+        log_wait = deltas[0] / deltas[1] if deltas[1] > 0 else 0.0
+        other_wait = deltas[2] / deltas[3] if deltas[3] > 0 else 0.0
+        return log_wait, other_wait, blocked
+
+    def update(self, cursor):
+        """Sample the server and adjust batch size and pause.
+
+        Returns a progress message when the pace changed, otherwise None.
+        """
+        measured = self.measure(cursor)
+        if measured is None:
+            return None
+        log_wait, other_wait, blocked = measured
+        pressure = f"log flush {log_wait:.1f} ms, lock/IO {other_wait:.1f} ms"
+
+        if blocked or max(log_wait, other_wait) > self.latency_ms:
+            self.slowdowns += 1
+            self.batch_size = max(self.MIN_BATCH_SIZE, self.batch_size // 2)
+            self.pause = min(self.MAX_PAUSE, max(self.MIN_PAUSE, self.pause * 2))
+            reason = f"{blocked} blocked sessions" if blocked else pressure
+            return (
+                f"Throttling ({reason}): {self.batch_size} rows per chunk, "
+                f"{self.pause:.1f}s pause"
+            )
+
+        if max(log_wait, other_wait) < self.latency_ms / 2 and (
+            self.pause or self.batch_size < self.max_batch_size
+        ):
+            self.batch_size = min(self.max_batch_size, self.batch_size * 5 // 4 + 1)
+            self.pause = self.pause / 2 if self.pause >= 2 * self.MIN_PAUSE else 0.0
+            return (
+                f"Server load dropped ({pressure}): {self.batch_size} rows per "
+                f"chunk, {self.pause:.1f}s pause"
+            )
+        return None
+
+    def wait(self):
+        """Sleep for the current pause."""
+        if self.pause:
+            time.sleep(self.pause)
+            self.paused_seconds += self.pause
+
+    def wait_for_capacity(self, cursor, max_wait=60.0, interval=1.0):
+        """Wait until the server is under the latency budget, at most max_wait s."""
+        start = time.monotonic()
+        self.measure(cursor)
+        while self.enabled and time.monotonic() - start < max_wait:
+            time.sleep(interval)
+            measured = self.measure(cursor)
+            if measured is None:
+                break
+            log_wait, other_wait, blocked = measured
+            if max(log_wait, other_wait) <= self.latency_ms and not blocked:
+                break
+        self.paused_seconds += time.monotonic() - start
+
+    def format_summary(self):
+        """Return a line describing how much the job was throttled."""
+        if not self.enabled:
+            return "Throttling unavailable (VIEW SERVER STATE needed)"
+        return (
+            f"Throttled {self.slowdowns} time(s), paused {self.paused_seconds:.1f}s, "
+            f"final chunk size {self.batch_size} rows"
+        )
+
+
+class RowProgress:
+    """Row-based progress of one job phase with throughput and ETA.
+
+    total is 0 when the number of expected rows is unknown.
+    """
+
+    def __init__(self, phase, total):
+        self.phase = phase
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, rows):
+        """Mark rows as processed; safe to call from parallel table groups."""
+        with self._lock:
+            self.done += rows
+
+    @property
+    def rate(self):
+        """Processed rows per second."""
+        elapsed = time.monotonic() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Estimated seconds until the phase completes, or None if unknown."""
+        if not self.total or not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def __str__(self):
+        if self.total:
+            text = f"{self.phase}: {self.done:,} / {self.total:,} rows"
+        else:
+            text = f"{self.phase}: {self.done:,} rows"
+        text += f" ({self.rate:,.0f} rows/s"
+        if self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            hours, minutes = divmod(minutes, 60)
+            text += f", ETA {hours}:{minutes:02d}:{seconds:02d}"
+        return text + ")"
+
+
+class RunReport:
+    """Timing, row count and I/O statistics of every statement a job executed."""
+
+    IO_PATTERNS = {
+        "logical_reads": re.compile(r"logical reads (\d+)"),
+        "physical_reads": re.compile(r"physical reads (\d+)"),
+    }
+    TIME_PATTERN = re.compile(r"CPU time = (\d+) ms,\s*elapsed time = (\d+) ms")
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = datetime.now()
+        self.steps = []
+        self.seconds = 0.0
+        self.error = None
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, sql, seconds, rows):
+        """Record one executed statement and return its entry."""
+        entry = {
+            "step": step,
+            "sql": " ".join(sql.split())[:500],
+            "seconds": round(seconds, 4),
+            "rows": rows,
+            "logical_reads": None,
+            "physical_reads": None,
+            "cpu_ms": None,
+            "elapsed_ms": None,
+        }
+        with self._lock:
+            self.steps.append(entry)
+        return entry
+
+    def add_statistics(self, entry, messages):
+        """Fill in an entry from SET STATISTICS IO/TIME informational messages."""
+        text = "\n".join(str(message) for message in messages)
+        for key, pattern in self.IO_PATTERNS.items():
+            values = [int(value) for value in pattern.findall(text)]
+            if values:
+                entry[key] = sum(values)
+        times = self.TIME_PATTERN.findall(text)
+        if times:
+            entry["cpu_ms"] = sum(int(cpu) for cpu, _ in times)
+            entry["elapsed_ms"] = sum(int(elapsed) for _, elapsed in times)
+
+    def slowest(self, count=5):
+        """Return the count slowest steps."""
+        return sorted(self.steps, key=lambda entry: entry["seconds"], reverse=True)[
+            :count
+        ]
+
+    def format_slowest(self, count=5):
+        """Return the slowest steps as readable text."""
+        lines = ["Slowest steps:"]
+        for entry in self.slowest(count):
+            reads = entry["logical_reads"]
+            reads = f", {reads} logical reads" if reads is not None else ""
+            rows = f", {entry['rows']} rows" if entry["rows"] >= 0 else ""
+            lines.append(f"{entry['seconds']:8.2f}s  {entry['step']}{rows}{reads}")
+        return "\n".join(lines)
+
+    def write(self, directory=REPORT_DIR):
+        """Write the report as JSON lines and return the file path.
+
+        Reports of jobs started in the same second, also by other processes,
+        get a -2 suffix, and so on, instead of overwriting each other.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = f"{self.started.strftime('%Y%m%d-%H%M%S')}-{self.operation}"
+        count = 1
+        while True:
+            suffix = f"-{count}" if count > 1 else ""
+            path = os.path.join(directory, f"{name}{suffix}.jsonl")
+            try:
+                f = open(path, "x")
+                break
+            except FileExistsError:
+                count += 1
+        with f:
+            header = {
+                "type": "run",
+                "operation": self.operation,
+                "started": self.started.isoformat(timespec="seconds"),
+                "seconds": round(self.seconds, 4),
+                "success": self.error is None,
+                "error": self.error,
+                "retries": self.retries,
+                "steps": len(self.steps),
+            }
+            f.write(json.dumps(header) + "\n")
+            for index, entry in enumerate(self.steps, 1):
+                f.write(json.dumps({"type": "step", "index": index, **entry}) + "\n")
+        return path
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that records every statement in the job's RunReport."""
+
+    def __init__(self, cursor, job):
+        self._cursor = cursor
+        self._job = job
+        self._entry = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _collect_statistics(self):
+        # Statistics of SELECTs arrive while fetching, so the previous entry is
+        # completed from the cursor messages right before the next statement
+        if self._entry is not None:
+            self._job.report.add_statistics(
+                self._entry, getattr(self._cursor, "messages", [])
+            )
+
+    def execute(self, sql, *params):
+        self._collect_statistics()
+        start = time.monotonic()
+        try:
+            return self._cursor.execute(sql, *params)
+        finally:
+            self._entry = self._job.report.record(
+                self._job.step, sql, time.monotonic() - start, self._cursor.rowcount
+            )
+            self._collect_statistics()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._collect_statistics()
+        start = time.monotonic()
+        try:
+            return self._cursor.executemany(sql, seq_of_parameters)
+        finally:
+            self._entry = self._job.report.record(
+                self._job.step, sql, time.monotonic() - start, self._cursor.rowcount
+            )
+            self._collect_statistics()
+
+    def close(self):
+        self._collect_statistics()
+        self._cursor.close()
+
+
+class Job:
+    """Base class for operations run against a connection pool.
+
+    Subclasses implement perform(), which returns a summary message or raises
+    on failure. run() wraps it with instrumentation: every statement executed
+    through cursor() is timed and its I/O statistics recorded in report,
+    which is written to REPORT_DIR as JSON lines afterwards.
+
+    Progress messages are passed to the on_progress callback and row-based
+    progress to on_row_progress as a RowProgress; callers may replace both.
+    The number of rows the job affected (or would affect, for estimates) is
+    collected in rows for combined reports.
+
+    Units of work run through run_unit() are retried with jittered backoff
+    after lock timeouts and deadlocks; retry_count is added to the summary.
+    committed_units counts units a job committed on their own before it
+    finished, so a failed job with any of them must not simply be rerun.
+
+    tables lists the tables the job works on, and read_only tells whether it
+    leaves them unchanged; JobScheduler uses both to decide which jobs may
+    run at the same time.
+    """
+
+    name = "job"
+    read_only = False
+    report_dir = REPORT_DIR
+    # First delay and cap in seconds of the backoff between lock retries
+    retry_delay = 0.5
+    max_retry_delay = 10.0
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.on_progress = lambda message: None
+        self.on_row_progress = lambda progress: None
+        self.rows = 0
+        self._rows_lock = threading.Lock()
+        self.phase = RowProgress("", 0)
+        self.step = ""
+        self.report = RunReport(self.name)
+        self.report_path = None
+        self.retry_count = 0
+        self.committed_units = 0
+        self.tables = []
+
+    def progress(self, message):
+        """Report a progress message; it also labels the following statements."""
+        self.step = message
+        self.on_progress(message)
+
+    def row_progress(self, progress):
+        """Report row-based progress."""
+        self.on_row_progress(progress)
+
+    def cursor(self, conn):
+        """Return an instrumented cursor with I/O and time statistics enabled.
+
+        The session lock timeout of the pool is applied as well.
+        """
+        cursor = conn.cursor()
+        cursor.execute(
+            "SET STATISTICS IO ON; SET STATISTICS TIME ON; "
+            f"SET LOCK_TIMEOUT {int(self.pool.lock_timeout)};"
+        )
+        return InstrumentedCursor(cursor, self)
+
+    def run_unit(self, conn, unit, label):
+        """Run unit() and return its result, retrying it after lock errors.
+
+        On a lock timeout or deadlock the transaction on conn is rolled back
+        and unit is called again after a jittered exponential backoff, up to
+        pool.lock_retries times. unit must therefore redo everything done
+        since the last commit.
+        """
+        attempt = 0
+        while True:
+            try:
+                return unit()
+            except Exception as e:
+                kind = get_lock_error(e)
+                if kind is None or attempt >= self.pool.lock_retries:
+                    raise
+                conn.rollback()
+                attempt += 1
+                with self._rows_lock:
+                    self.retry_count += 1
+                delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+                delay *= random.uniform(0.5, 1.5)
+                self.progress(
+                    f"{label}: {kind}, retrying in {delay:.1f}s "
+                    f"(attempt {attempt + 1} of {self.pool.lock_retries + 1})..."
+                )
+                time.sleep(delay)
+
+    def verify_table(self, cursor, table, backup_source, columns=None, source=None):
+        """Return the key ranges in which table differs from its backup.
+
+        columns restricts the comparison to the columns of a column backup,
+        source replaces table as the side compared with the backup.
+        """
+        self.progress(f"Verifying {table} against its backup...")
+        return compare_table_checksums(
+            cursor,
+            self.pool.catalog,
+            table,
+            source or table,
+            backup_source,
+            columns=columns,
+        )
+
+    def count_rows(self, rows):
+        """Add rows to the row count; safe to call from parallel table groups."""
+        with self._rows_lock:
+            self.rows += rows
+
+    def start_phase(self, phase, total):
+        """Start a new progress phase expecting total rows (0 if unknown)."""
+        self.phase = RowProgress(phase, total)
+        self.row_progress(self.phase)
+
+    def advance(self, rows):
+        """Report rows processed in the current phase."""
+        self.phase.advance(rows)
+        self.row_progress(self.phase)
+
+    def perform(self):
+        raise NotImplementedError
+
+    def run(self):
+        """Perform the job, then write its run report if it executed anything."""
+        self.report = RunReport(self.name)
+        start = time.monotonic()
+        try:
+            summary = self.perform()
+            if self.retry_count:
+                summary += (
+                    f"\n\nRetried after lock timeouts or deadlocks: "
+                    f"{self.retry_count} time(s)"
+                )
+            return summary
+        except Exception as e:
+            self.report.error = str(e)
+            raise
+        finally:
+            self.report.seconds = time.monotonic() - start
+            self.report.retries = self.retry_count
+            if self.report.steps:
+                try:
+                    self.report_path = self.report.write(self.report_dir)
+                except OSError as e:
+                    self.on_progress(f"Could not write run report: {str(e)}")
+
+
+class BackupJob(Job):
+    """Create backup of specified tables."""
+
+    name = "backup"
+
+    def __init__(
+        self,
+        pool,
+        tables,
+        incremental=False,
+        workers=1,
+        source=None,
+        verify=True,
+        columns=None,
+    ):
+        super().__init__(pool)
+        self.tables = tables
+        self.incremental = incremental
+        self.workers = workers
+        # {table: columns} backed up besides the primary key instead of whole
+        # rows, e.g. the backup_columns of a patch
+        self.columns = columns or {}
+        # Patch the backup is taken for, recorded in the backup catalog
+        self.source = source
+        # Compare every table with its backup by checksums afterwards
+        self.verify = verify
+        self.generation = None
+        self.expected_rows = {}
+
+    def backup_incremental(self, cursor, table, pk_columns, columns):
+        """Append rows changed since the last backup to the delta chain of table.
+
+        columns are those held by the base backup; changes to other columns
+        of a column backup are not recorded.
+        Returns (changed, inserted, deleted) row counts.
+        """
+        catalog = self.pool.catalog
+        delta_table = catalog.backup_name(table, "_Backup_Delta")
+        checksum_table = catalog.backup_name(table, "_Backup_Checksum")
+        pk_list = ", ".join([f"t.[{col}]" for col in pk_columns])
+        pk_match = " AND ".join([f"c.[{col}] = k.[{col}]" for col in pk_columns])
+        row_checksum = get_row_checksum(columns)
+        t_column_list = ", ".join([f"t.[{col}]" for col in columns])
+
+        # Checksums of the last backed-up state; built from the base backup
+        # the first time an incremental backup runs
+        if not self.pool.catalog.exists(checksum_table):
+            cursor.execute(f"""
+                SELECT {pk_list}, {row_checksum} AS RowChecksum
+                INTO {checksum_table}
+                FROM {catalog.backup_name(table)} t
+            """)
+
+        # The outer join makes all columns nullable (deleted rows only carry
+        # their key) and keeps SELECT INTO from copying the IDENTITY property
+        if not self.pool.catalog.exists(delta_table):
+            cursor.execute(f"""
+                SELECT TOP (0) {t_column_list}, CAST(0 AS int) AS DeltaSeq,
+                    CAST('U' AS char(1)) AS DeltaOp
+                INTO {delta_table}
+                FROM (SELECT 1 AS Dummy) d
+                LEFT JOIN {table} t ON 1 = 0
+            """)
+
+        cursor.execute(f"SELECT ISNULL(MAX(DeltaSeq), 0) + 1 FROM {delta_table}")
+        seq = cursor.fetchone()[0]
+
+        cursor.execute(f"""
+            SELECT {pk_list}, {row_checksum} AS RowChecksum
+            INTO #CurrentChecksum
+            FROM {table} t
+        """)
+
+        try:
+            column_list = ", ".join([f"[{col}]" for col in columns])
+            t_match = " AND ".join([f"t.[{col}] = c.[{col}]" for col in pk_columns])
+            key_columns = ", ".join([f"[{col}]" for col in pk_columns])
+            k_key_columns = ", ".join([f"k.[{col}]" for col in pk_columns])
+
+            cursor.execute(f"""
+                INSERT INTO {delta_table} ({column_list}, DeltaSeq, DeltaOp)
+                SELECT {t_column_list}, {seq}, CASE WHEN k.RowChecksum IS NULL THEN 'I' ELSE 'U' END
+                FROM {table} t
+                INNER JOIN #CurrentChecksum c ON {t_match}
+                LEFT JOIN {checksum_table} k ON {pk_match}
+                WHERE k.RowChecksum IS NULL OR k.RowChecksum <> c.RowChecksum
+            """)
+
+            cursor.execute(f"""
+                INSERT INTO {delta_table} ({key_columns}, DeltaSeq, DeltaOp)
+                SELECT {k_key_columns}, {seq}, 'D'
+                FROM {checksum_table} k
+                WHERE NOT EXISTS (SELECT 1 FROM #CurrentChecksum c WHERE {pk_match})
+            """)
+
+            cursor.execute(f"""
+                SELECT
+                    SUM(CASE WHEN DeltaOp = 'U' THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN DeltaOp = 'I' THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN DeltaOp = 'D' THEN 1 ELSE 0 END)
+                FROM {delta_table}
+                WHERE DeltaSeq = {seq}
+            """)
+            changed, inserted, deleted = [count or 0 for count in cursor.fetchone()]
+
+            # Bring the stored checksums up to date with the new state
+            cursor.execute(f"""
+                UPDATE k
+                SET k.RowChecksum = c.RowChecksum
+                FROM {checksum_table} k
+                INNER JOIN #CurrentChecksum c ON {pk_match}
+                WHERE k.RowChecksum <> c.RowChecksum
+            """)
+            cursor.execute(f"""
+                INSERT INTO {checksum_table}
+                SELECT c.*
+                FROM #CurrentChecksum c
+                WHERE NOT EXISTS (SELECT 1 FROM {checksum_table} k WHERE {pk_match})
+            """)
+            cursor.execute(f"""
+                DELETE k
+                FROM {checksum_table} k
+                WHERE NOT EXISTS (SELECT 1 FROM #CurrentChecksum c WHERE {pk_match})
+            """)
+        finally:
+            cursor.execute("DROP TABLE #CurrentChecksum")
+
+        return changed, inserted, deleted
+
+    def backup_group(self, cursor, tables):
+        """Back up a list of tables and return one info line per table."""
+        backup_info = []
+        # Counted once at the end, as the group may be retried after lock errors
+        rows = 0
+
+        for table in tables:
+            backup_table = self.pool.catalog.backup_name(table)
+            columns = resolve_backup_columns(
+                self.pool.catalog, table, self.columns.get(table)
+            )
+
+            # Deltas hold the columns of the current backup, so they can only
+            # extend one holding every column asked for
+            held = get_backup_columns(self.pool.catalog, table)
+            note = ""
+            if self.incremental and self.pool.catalog.exists(backup_table):
+                pk_columns = self.pool.catalog.primary_key(table)
+                needed = columns or self.pool.catalog.columns(table)
+                if pk_columns and all(col in held for col in needed):
+                    self.progress(f"Creating incremental backup of {table}...")
+                    changed, inserted, deleted = self.backup_incremental(
+                        cursor, table, pk_columns, held
+                    )
+                    rows += changed + inserted + deleted
+                    self.advance(self.expected_rows.get(table, 0))
+                    backup_info.append(
+                        f"{table}: {changed} changed, {inserted} inserted, "
+                        f"{deleted} deleted rows stored as delta"
+                        + (
+                            f" of {len(held)} of "
+                            f"{len(self.pool.catalog.columns(table))} columns"
+                            if held != self.pool.catalog.columns(table)
+                            else ""
+                        )
+                    )
+                    continue
+                note = (
+                    " as a new generation, as the current backup does not hold "
+                    "these columns"
+                    if pk_columns
+                    else " as a new generation, as deltas need a primary key"
+                )
+
+            self.progress(f"Creating backup of {table}...")
+            evicted = self.pool.backups.create_generation(
+                cursor, self.pool.catalog, table, self.generation, self.source, columns
+            )
+
+            cursor.execute(f"SELECT COUNT(*) FROM {backup_table}")
+            row_count = cursor.fetchone()[0]
+            rows += row_count
+            self.advance(row_count)
+            backup_info.append(
+                f"{table}: {row_count} rows backed up{note}"
+                + (
+                    f" ({len(columns)} of {len(self.pool.catalog.columns(table))} "
+                    f"columns: {', '.join(columns)})"
+                    if columns
+                    else ""
+                )
+                + (f", evicted generations {', '.join(evicted)}" if evicted else "")
+            )
+
+        if self.verify:
+            self.pool.catalog.refresh(cursor, tables)
+            for table in tables:
+                differences = self.verify_table(
+                    cursor,
+                    table,
+                    get_backup_source(self.pool.catalog, table),
+                    get_backup_columns(self.pool.catalog, table),
+                )
+                if differences:
+                    # Rows the game server changed meanwhile also end up here
+                    backup_info.append(
+                        f"{table}: WARNING: backup differs from the table at "
+                        + format_key_ranges(self.pool.catalog, table, differences)
+                    )
+                else:
+                    backup_info.append(f"{table}: backup verified by checksum")
+
+        self.count_rows(rows)
+        return backup_info
+
+    def perform(self):
+        """Create backup of specified tables."""
+        self.generation = BackupStore.new_generation()
+        with self.pool.connection() as conn:
+            cursor = self.cursor(conn)
+            self.pool.catalog.refresh(cursor, self.tables)
+            self.pool.backups.ensure_catalog(cursor)
+            conn.commit()
+            groups = group_tables_by_foreign_keys(
+                self.tables, get_foreign_key_references(cursor, self.tables)
+            )
+            self.expected_rows = get_row_counts(cursor, self.tables)
+            self.start_phase("Backup", sum(self.expected_rows.values()))
+
+            if self.workers <= 1 or len(groups) == 1:
+                tables = [table for group in groups for table in group]
+                backup_info = self.run_unit(
+                    conn, lambda: self.backup_group(cursor, tables), "Backup"
+                )
+                conn.commit()
+
+        if self.workers > 1 and len(groups) > 1:
+            self.progress(
+                f"Backing up {len(self.tables)} tables with {self.workers} workers..."
+            )
+            results = run_table_groups(
+                self.pool,
+                groups,
+                self.backup_group,
+                self.workers,
+                self.cursor,
+                self.run_unit,
+            )
+            backup_info = [line for lines in results for line in lines]
+
+        if self.pool.backups.compression_unsupported:
+            backup_info.append(COMPRESSION_NOTE)
+        return (
+            f"Backup created successfully!\n\nGeneration: {self.generation}\n"
+            + "\n".join(backup_info)
+        )
+
+
+class RestoreJob(Job):
+    """Restore tables from backup."""
+
+    name = "restore"
+
+    def __init__(
+        self,
+        pool,
+        tables,
+        workers=1,
+        source_dir=None,
+        batch_size=1000,
+        generation=None,
+        throttle_latency=0,
+        verify=True,
+        columns=None,
+    ):
+        super().__init__(pool)
+        self.tables = tables
+        self.workers = workers
+        self.source_dir = source_dir
+        self.batch_size = batch_size
+        # Backup generation to restore instead of the current backup
+        self.generation = generation
+        # Columns per table the restored backup must hold, e.g. the backup
+        # columns of the patch being undone, see select_backup
+        self.columns = columns or {}
+        self.selected = {}
+        # Compare every restored table with its backup by checksums before
+        # committing, so a mismatch rolls the restore back
+        self.verify = verify
+        # A restore replaces whole tables in one transaction, so throttling
+        # can only hold back each unit until the server is under the budget
+        self.governor = (
+            ThrottleGovernor(throttle_latency, batch_size) if throttle_latency else None
+        )
+        self.sources = {}
+        self.import_generation = None
+        self.expected_rows = {}
+
+    def wait_for_capacity(self, cursor):
+        """Hold back the next unit of work while the server is over budget."""
+        if self.governor:
+            self.progress("Checking server load...")
+            self.governor.wait_for_capacity(cursor)
+
+    def get_backup_table(self, table):
+        """Return the table holding the backup of table that is restored."""
+        return self.sources.get(table, self.pool.catalog.backup_name(table))
+
+    def select_backup(self, cursor, table):
+        """Make sure the backup restored for table holds self.columns[table].
+
+        A column backup taken for another patch replaces the current backup,
+        so without a generation given the newest generation holding the
+        columns is restored instead. Raises if no generation holds them.
+        """
+        catalog = self.pool.catalog
+        needed = resolve_backup_columns(
+            catalog, table, self.columns[table]
+        ) or catalog.columns(table)
+
+        def missing(backup_table):
+            held = get_backup_columns(catalog, table, backup_table)
+            return [col for col in needed if col not in held]
+
+        absent = missing(self.get_backup_table(table))
+        if not absent:
+            return
+        if self.generation:
+            raise Exception(
+                f"Backup generation {self.generation} of {table} does not hold "
+                f"{', '.join(absent)}!"
+            )
+
+        generations = self.pool.backups.generations(cursor, table)
+        catalog.refresh(
+            cursor, [generation["backup_table"] for generation in generations], False
+        )
+        for generation in generations:
+            backup_table = generation["backup_table"]
+            if catalog.exists(backup_table) and not missing(backup_table):
+                self.sources[table] = backup_table
+                self.selected[table] = generation["generation"]
+                return
+        raise Exception(
+            f"No backup of {table} holds {', '.join(absent)}! The current backup "
+            f"holds other columns and no older generation is kept."
+        )
+
+    def import_backup(self, cursor, table):
+        """Load the exported file of table into <table>_Backup.
+
+        Rows are inserted with parameterized batches of batch_size rows while
+        the file is read, so memory use does not depend on the table size.
+        Returns the number of imported rows.
+        """
+        path = get_export_path(self.source_dir, table)
+        digest = hashlib.sha256()
+        rows = 0
+        footer = None
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "null")
+            if not header or header.get("format") != EXPORT_FORMAT:
+                raise Exception(f"{path} is not an exported backup file!")
+            columns = header["columns"]
+            if sorted(columns) != sorted(self.pool.catalog.columns(table)):
+                raise Exception(
+                    f"Columns of {table} do not match the exported backup {path}!"
+                )
+
+            # An empty copy without IDENTITY, so exported values can be inserted
+            backup_table = self.pool.catalog.backup_name(table)
+            self.pool.backups.archive_current(
+                cursor, self.pool.catalog, table, self.import_generation
+            )
+            drop_backup_tables(cursor, self.pool.catalog, table)
+            cursor.execute(f"""
+                SELECT TOP (0) t.*
+                INTO {backup_table}
+                FROM (SELECT 1 AS Dummy) d
+                LEFT JOIN {table} t ON 1 = 0
+            """)
+
+            column_list = ", ".join([f"[{col}]" for col in columns])
+            placeholders = ", ".join(["?"] * len(columns))
+            insert_sql = (
+                f"INSERT INTO {backup_table} ({column_list}) VALUES ({placeholders})"
+            )
+
+            batch = []
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    footer = record
+                    break
+                digest.update(line.rstrip("\n").encode("utf-8"))
+                batch.append([decode_value(value) for value in record])
+                if len(batch) >= self.batch_size:
+                    cursor.executemany(insert_sql, batch)
+                    rows += len(batch)
+                    self.advance(len(batch))
+                    batch = []
+            if batch:
+                cursor.executemany(insert_sql, batch)
+                rows += len(batch)
+                self.advance(len(batch))
+
+        if footer is None:
+            raise Exception(f"{path} is incomplete!")
+        if footer["rows"] != rows or footer["sha256"] != digest.hexdigest():
+            raise Exception(f"Checksum mismatch in {path}!")
+        self.pool.backups.record(
+            cursor,
+            table,
+            self.import_generation,
+            self.pool.catalog.backup_name(table),
+            f"import of {path}",
+        )
+        return rows
+
+    def restore_group(self, cursor, tables):
+        """Restore a list of tables ordered parents first.
+
+        Updates and inserts run parents first and deletes run children first,
+        so foreign keys between the tables hold at every step. Tables with a
+        column backup only get those columns restored in the rows they share
+        with the backup; no rows are inserted or deleted.
+        Returns one info line per table.
+        """
+        counts = {}
+        plans = {}
+        sources = {}
+        partial = {}
+
+        for table in tables:
+            self.progress(f"Restoring {table} from backup...")
+
+            pk_columns = self.pool.catalog.primary_key(table)
+            all_columns = self.pool.catalog.columns(table)
+            backup_source = self.sources.get(table) or get_backup_source(
+                self.pool.catalog, table
+            )
+            backup_columns = get_backup_columns(
+                self.pool.catalog, table, self.get_backup_table(table)
+            )
+            if pk_columns and backup_columns != all_columns:
+                partial[table] = backup_columns
+
+            if pk_columns:
+                # Build join condition on primary key
+                join_condition = " AND ".join(
+                    [f"t.[{col}] = b.[{col}]" for col in pk_columns]
+                )
+                non_pk_columns = [
+                    col for col in backup_columns if col not in pk_columns
+                ]
+
+                # Update only rows whose values differ from the backup.
+                # EXCEPT compares NULLs as equal, unlike <>.
+                updated = 0
+                if non_pk_columns:
+                    update_set = ", ".join(
+                        [f"t.[{col}] = b.[{col}]" for col in non_pk_columns]
+                    )
+                    t_columns = ", ".join([f"t.[{col}]" for col in non_pk_columns])
+                    b_columns = ", ".join([f"b.[{col}]" for col in non_pk_columns])
+                    cursor.execute(f"""
+                        UPDATE t
+                        SET {update_set}
+                        FROM {table} t
+                        INNER JOIN {backup_source} b ON {join_condition}
+                        WHERE EXISTS (
+                            SELECT {t_columns}
+                            EXCEPT
+                            SELECT {b_columns}
+                        )
+                    """)
+                    updated = cursor.rowcount
+
+                sources[table] = backup_source
+                counts[table] = [updated, 0, 0]
+                if table in partial:
+                    # Rows cannot be recreated from some of their columns
+                    self.advance(
+                        self.expected_rows.get(self.get_backup_table(table), 0)
+                    )
+                    continue
+
+                # Insert rows that exist in backup but not in original
+                cursor.execute(f"""
+                    INSERT INTO {table}
+                    SELECT b.*
+                    FROM {backup_source} b
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {table} t WHERE {join_condition}
+                    )
+                """)
+                counts[table][1] = cursor.rowcount
+                plans[table] = (backup_source, join_condition)
+            else:
+                # Fallback: no primary key found, use original delete/insert approach
+                cursor.execute(f"DELETE FROM {table}")
+                deleted = cursor.rowcount
+                cursor.execute(f"INSERT INTO {table} SELECT b.* FROM {backup_source} b")
+                counts[table] = [0, cursor.rowcount, deleted]
+                sources[table] = backup_source
+                self.advance(self.expected_rows.get(self.get_backup_table(table), 0))
+
+        # Delete rows that exist in original but not in backup, children first
+        for table in reversed(tables):
+            if table not in plans:
+                continue
+            backup_source, join_condition = plans[table]
+            cursor.execute(f"""
+                DELETE t
+                FROM {table} t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {backup_source} b WHERE {join_condition}
+                )
+            """)
+            counts[table][2] = cursor.rowcount
+            self.advance(self.expected_rows.get(self.get_backup_table(table), 0))
+
+        restore_info = [
+            f"{table}: {updated} rows updated from a column backup of "
+            f"{', '.join(partial[table])}"
+            if table in partial
+            else f"{table}: {updated} rows updated, {inserted} inserted, "
+            f"{deleted} deleted"
+            for table, (updated, inserted, deleted) in counts.items()
+        ]
+        if self.verify:
+            for table in tables:
+                source = None
+                if table in partial:
+                    # Only the rows the table shares with the backup are restored
+                    match = " AND ".join(
+                        [
+                            f"l.[{col}] = b.[{col}]"
+                            for col in self.pool.catalog.primary_key(table)
+                        ]
+                    )
+                    shared = f"FROM {sources[table]} b INNER JOIN {table} l ON {match}"
+                    source = f"(SELECT l.* {shared})"
+                    sources[table] = f"(SELECT b.* {shared})"
+                differences = self.verify_table(
+                    cursor, table, sources[table], partial.get(table), source
+                )
+                if differences:
+                    raise Exception(
+                        f"Verification failed: {table} differs from its backup at "
+                        + format_key_ranges(self.pool.catalog, table, differences)
+                        + ". The restore was rolled back."
+                    )
+            restore_info.append("All tables verified by checksum")
+
+        self.count_rows(sum(sum(table_counts) for table_counts in counts.values()))
+        return restore_info
+
+    def perform(self):
+        """Restore tables from backup."""
+        with self.pool.connection() as conn:
+            cursor = self.cursor(conn)
+
+            if self.source_dir:
+                self.pool.catalog.refresh(cursor, self.tables)
+                self.pool.backups.ensure_catalog(cursor)
+                self.import_generation = BackupStore.new_generation()
+                self.start_phase("Import", 0)
+
+                def import_all():
+                    for table in self.tables:
+                        self.progress(f"Importing {table} from {self.source_dir}...")
+                        self.import_backup(cursor, table)
+
+                self.wait_for_capacity(cursor)
+                self.run_unit(conn, import_all, "Import")
+                conn.commit()
+
+            self.progress("Checking for backups...")
+            self.pool.catalog.refresh(cursor, self.tables)
+
+            for table in self.tables:
+                if self.generation:
+                    backup_table = self.pool.backups.find(
+                        cursor, table, self.generation
+                    )
+                    if backup_table is None:
+                        raise Exception(
+                            f"No backup generation {self.generation} found for {table}!"
+                        )
+                    if backup_table != self.pool.catalog.backup_name(table):
+                        self.sources[table] = backup_table
+                elif not self.pool.catalog.exists(self.pool.catalog.backup_name(table)):
+                    raise Exception(f"No backup found for {table}!")
+            # Older generations tell by their columns whether they are column backups
+            self.pool.catalog.refresh(cursor, list(self.sources.values()), False)
+            for table in self.tables:
+                if table in self.columns:
+                    self.select_backup(cursor, table)
+
+            groups = group_tables_by_foreign_keys(
+                self.tables, get_foreign_key_references(cursor, self.tables)
+            )
+            self.expected_rows = get_row_counts(
+                cursor, [self.get_backup_table(table) for table in self.tables]
+            )
+            self.start_phase("Restore", sum(self.expected_rows.values()))
+            self.wait_for_capacity(cursor)
+
+            if self.workers <= 1 or len(groups) == 1:
+                tables = [table for group in groups for table in group]
+                restore_info = self.run_unit(
+                    conn, lambda: self.restore_group(cursor, tables), "Restore"
+                )
+                conn.commit()
+
+        if self.workers > 1 and len(groups) > 1:
+            self.progress(
+                f"Restoring {len(self.tables)} tables with {self.workers} workers..."
+            )
+            results = run_table_groups(
+                self.pool,
+                groups,
+                self.restore_group,
+                self.workers,
+                self.cursor,
+                self.run_unit,
+            )
+            restore_info = [line for lines in results for line in lines]
+
+        restore_info += [
+            f"{table}: restored from generation {generation}, the newest holding "
+            f"{', '.join(self.columns[table])}"
+            for table, generation in self.selected.items()
+        ]
+        if self.governor and self.governor.enabled:
+            restore_info.append(
+                f"Waited {self.governor.paused_seconds:.1f}s for server load to drop"
+            )
+        elif self.governor:
+            restore_info.append(self.governor.format_summary())
+        return "Restore completed successfully!\n\n" + "\n".join(restore_info)
+
+
+class ExportJob(Job):
+    """Export tables to compressed files that can be restored with RestoreJob.
+
+    Each table is written to <directory>/<table>.jsonl.gz: a header line with
+    the schema, one JSON array per row and a footer line with the row count
+    and a SHA-256 checksum of the row lines. Rows are streamed with fetchmany,
+    so memory use does not depend on the table size.
+    """
+
+    name = "export"
+    read_only = True
+
+    def __init__(self, pool, tables, directory, fetch_size=5000):
+        super().__init__(pool)
+        self.tables = tables
+        self.directory = directory
+        self.fetch_size = fetch_size
+
+    def export_table(self, cursor, table):
+        """Write the rows of table to its export file and return the row count."""
+        info = self.pool.catalog.get(table)
+        path = get_export_path(self.directory, table)
+        header = {
+            "format": EXPORT_FORMAT,
+            "tool_version": get_version(),
+            "table": table,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "columns": info.columns,
+            "types": info.types,
+            "primary_key": info.primary_key,
+        }
+        column_list = ", ".join([f"[{col}]" for col in info.columns])
+        cursor.execute(f"SELECT {column_list} FROM {table}")
+
+        digest = hashlib.sha256()
+        rows = 0
+        # Written under a temporary name so an interrupted export never
+        # replaces a complete file
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            while True:
+                batch = cursor.fetchmany(self.fetch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    line = json.dumps([encode_value(value) for value in row])
+                    digest.update(line.encode("utf-8"))
+                    f.write(line + "\n")
+                rows += len(batch)
+                self.advance(len(batch))
+            f.write(json.dumps({"rows": rows, "sha256": digest.hexdigest()}) + "\n")
+        os.replace(path + ".tmp", path)
+        return rows
+
+    def perform(self):
+        """Export the tables to the export directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.pool.connection() as conn:
+            cursor = self.cursor(conn)
+            self.pool.catalog.refresh(cursor, self.tables)
+            for table in self.tables:
+                if not self.pool.catalog.exists(table):
+                    raise Exception(f"Table {table} does not exist!")
+
+            expected_rows = get_row_counts(cursor, self.tables)
+            self.start_phase("Export", sum(expected_rows.values()))
+
+            export_info = []
+            for table in self.tables:
+                self.progress(f"Exporting {table}...")
+                row_count = self.run_unit(
+                    conn,
+                    lambda: self.export_table(cursor, table),
+                    f"Export of {table}",
+                )
+                self.count_rows(row_count)
+                export_info.append(
+                    f"{table}: {row_count} rows exported to "
+                    f"{get_export_path(self.directory, table)}"
+                )
+
+        return "Export completed successfully!\n\n" + "\n".join(export_info)
+
+
+class TableDiff:
+    """Rows that differ between a table and its backup, read page by page.
+
+    build() ranks the keys and backup values of changed, added and removed
+    rows into a #Diff temp table on a connection of its own, so the diff is
+    computed on the server once and the unindexed backup is read only then.
+    page() then reads page_size rows by rank through an index seek, joined to
+    the live table by primary key, and only the last cached_pages pages are
+    kept in memory.
+    """
+
+    PAGE_SIZE = 200
+    CACHED_PAGES = 4
+
+    # Change kinds, as in the DeltaOp column of incremental backups
+    CHANGED, ADDED, REMOVED = "U", "I", "D"
+
+    def __init__(
+        self, pool, conn, table, page_size=PAGE_SIZE, cached_pages=CACHED_PAGES
+    ):
+        self.pool = pool
+        self.conn = conn
+        self.table = table
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        # Column backups only hold some columns to compare
+        self.columns = get_backup_columns(pool.catalog, table)
+        self.key_columns = pool.catalog.primary_key(table)
+        self.source = get_backup_source(pool.catalog, table)
+        self.counts = {self.CHANGED: 0, self.ADDED: 0, self.REMOVED: 0}
+        self._pages = OrderedDict()
+
+    @property
+    def total(self):
+        """Number of rows in the diff."""
+        return sum(self.counts.values())
+
+    def build(self, cursor):
+        """Compute the diff on the server and count its rows by change kind."""
+        first_key = self.key_columns[0]
+        keys = ", ".join(
+            [f"ISNULL(t.[{col}], b.[{col}]) AS [{col}]" for col in self.key_columns]
+        )
+        order = ", ".join([f"ISNULL(t.[{col}], b.[{col}])" for col in self.key_columns])
+        join_condition = " AND ".join(
+            [f"t.[{col}] = b.[{col}]" for col in self.key_columns]
+        )
+        t_columns = ", ".join([f"t.[{col}]" for col in self.columns])
+        b_columns = ", ".join([f"b.[{col}]" for col in self.columns])
+        # Backup values are numbered, as their names may clash with the keys
+        b_values = ", ".join(
+            [f"b.[{col}] AS [Backup{i}]" for i, col in enumerate(self.columns)]
+        )
+        cursor.execute(f"""
+            SELECT ROW_NUMBER() OVER (ORDER BY {order}) AS DiffRow, {keys},
+                CASE
+                    WHEN b.[{first_key}] IS NULL THEN '{self.ADDED}'
+                    WHEN t.[{first_key}] IS NULL THEN '{self.REMOVED}'
+                    ELSE '{self.CHANGED}'
+                END AS DiffOp, {b_values}
+            INTO #Diff
+            FROM {self.table} t
+            FULL OUTER JOIN {self.source} b ON {join_condition}
+            WHERE t.[{first_key}] IS NULL OR b.[{first_key}] IS NULL
+            OR EXISTS (SELECT {t_columns} EXCEPT SELECT {b_columns})
+        """)
+        cursor.execute("CREATE UNIQUE CLUSTERED INDEX IX_Diff ON #Diff (DiffRow)")
+        cursor.execute("SELECT DiffOp, COUNT(*) FROM #Diff GROUP BY DiffOp")
+        for op, count in cursor.fetchall():
+            self.counts[op] = count
+        self.conn.commit()
+
+    def page(self, number):
+        """Return the rows of page number as (kind, live values, backup values)."""
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+
+        t_match = " AND ".join([f"t.[{col}] = d.[{col}]" for col in self.key_columns])
+        t_columns = ", ".join([f"t.[{col}]" for col in self.columns])
+        b_columns = ", ".join([f"d.[Backup{i}]" for i in range(len(self.columns))])
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT d.DiffOp, {t_columns}, {b_columns}
+            FROM #Diff d
+            LEFT JOIN {self.table} t ON {t_match}
+            WHERE d.DiffRow BETWEEN ? AND ?
+            ORDER BY d.DiffRow
+            """,
+            number * self.page_size + 1,
+            (number + 1) * self.page_size,
+        )
+        width = len(self.columns)
+        rows = [
+            (row[0], tuple(row[1 : 1 + width]), tuple(row[1 + width :]))
+            for row in cursor.fetchall()
+        ]
+        # The page reads take no locks that need to outlive them
+        self.conn.commit()
+
+        self._pages[number] = rows
+        if len(self._pages) > self.cached_pages:
+            self._pages.popitem(last=False)
+        return rows
+
+    def row(self, index):
+        """Return row index of the diff as (kind, live values, backup values)."""
+        return self.page(index // self.page_size)[index % self.page_size]
+
+    def close(self):
+        """Drop the diff and return its connection to the pool."""
+        self._pages.clear()
+        try:
+            self.conn.cursor().execute("DROP TABLE #Diff")
+            self.conn.commit()
+        except Exception:
+            pass
+        self.pool.release(self.conn)
+
+
+class DiffJob(Job):
+    """Compute the rows a table differs in from its backup for viewing.
+
+    On success diff holds an open TableDiff, which the caller must close.
+    """
+
+    name = "diff"
+    read_only = True
+
+    def __init__(self, pool, table):
+        super().__init__(pool)
+        self.table = table
+        self.tables = [table]
+        self.diff = None
+
+    def perform(self):
+        """Compute the diff between the table and its backup."""
+        conn = self.pool.acquire()
+        try:
+            cursor = self.cursor(conn)
+            self.pool.catalog.refresh(cursor, [self.table])
+            if not self.pool.catalog.exists(self.pool.catalog.backup_name(self.table)):
+                raise Exception(f"No backup found for {self.table}!")
+            if not self.pool.catalog.primary_key(self.table):
+                raise Exception(
+                    f"{self.table} has no primary key to match rows with its backup!"
+                )
+
+            self.progress(f"Comparing {self.table} with its backup...")
+            diff = TableDiff(self.pool, conn, self.table)
+            diff.build(cursor)
+        except Exception:
+            self.pool.release(conn)
+            raise
+
+        self.diff = diff
+        return (
+            f"{self.table}: {diff.counts[diff.CHANGED]} changed, "
+            f"{diff.counts[diff.ADDED]} added, {diff.counts[diff.REMOVED]} removed rows"
+        )
+
+
+def combine_patches(patches, names):
+    """Merge several patches into one patch configuration applied as a unit.
+
+    The backup tables are the union of those of all patches, so they are
+    checked and backed up once; statements run in the order of names. A
+    table gets a column backup only if every patch backs up just columns.
+    Raises ValueError if patches declare a parameter of the same name with a
+    different type or default, as the statements of both share its value.
+    """
+    backup_tables = []
+    backup_columns = {}
+    sql_statements = []
+    parameters = {}
+    for name in names:
+        patch_config = patches[name]
+        for parameter, declaration in patch_config.get("parameters", {}).items():
+            previous = parameters.setdefault(parameter, declaration)
+            if any(
+                previous.get(key) != declaration.get(key) for key in ("type", "default")
+            ):
+                raise ValueError(
+                    f"Patches declare parameter '{parameter}' differently and "
+                    "cannot be combined"
+                )
+        for table in patch_config["backup_tables"]:
+            columns = patch_config.get("backup_columns", {}).get(table)
+            if table not in backup_tables:
+                backup_tables.append(table)
+                backup_columns[table] = list(columns) if columns else None
+            elif backup_columns[table] is not None:
+                backup_columns[table] = (
+                    backup_columns[table]
+                    + [col for col in columns if col not in backup_columns[table]]
+                    if columns
+                    else None
+                )
+        sql_statements += patch_config["sql_statements"]
+
+    return {
+        "description": "\n".join(patches[name]["description"] for name in names),
+        "backup_tables": backup_tables,
+        "backup_columns": {
+            table: columns for table, columns in backup_columns.items() if columns
+        },
+        "sql_statements": sql_statements,
+        "parameters": parameters,
+        "patches": list(names),
+    }
+
+
+class PatchJob(Job):
+    """Apply a database patch."""
+
+    name = "patch"
+
+    # Chunk size the throttle mode starts with when batching is not configured
+    THROTTLE_BATCH_SIZE = 5000
+
+    def __init__(
+        self,
+        pool,
+        patch_name,
+        patch_config,
+        batch_size=0,
+        parameters=None,
+        throttle_latency=0,
+    ):
+        super().__init__(pool)
+        self.patch_name = patch_name
+        self.patch_config = patch_config
+        self.tables = patch_config["backup_tables"]
+        self.parameters = get_parameter_values(patch_config, parameters)
+        # Combined patches must be applied all or nothing, which rules out
+        # committing in chunks - and with it throttling
+        combined = len(patch_config.get("patches", [])) > 1
+        self.batch_size = 0 if combined else batch_size
+        self.governor = None
+        if throttle_latency and not combined:
+            self.batch_size = self.batch_size or self.THROTTLE_BATCH_SIZE
+            self.governor = ThrottleGovernor(throttle_latency, self.batch_size)
+
+    def get_batch_key(self, table):
+        """Return the column used to split statements on table into key-range chunks."""
+        if "batch_key" in self.patch_config:
+            return self.patch_config["batch_key"]
+
+        pk_columns = self.pool.catalog.primary_key(table)
+        return pk_columns[0] if len(pk_columns) == 1 else None
+
+    def execute_batched(self, conn, cursor, sql, idx, total_statements):
+        """Execute an UPDATE in key-range chunks of batch_size rows, committing each chunk.
+
+        Returns the number of affected rows, or None if the statement cannot be batched.
+        """
+        target = parse_update_target(sql)
+        if target is None:
+            return None
+        table, alias = target
+        key = self.get_batch_key(table)
+        if key is None:
+            return None
+        key_expr = f"{alias}.[{key}]" if alias else f"[{key}]"
+
+        rows_affected = 0
+        chunk = 0
+        last_key = None
+        while True:
+            batch_size = self.governor.batch_size if self.governor else self.batch_size
+            # Find the upper key bound and size of the next batch_size rows
+            if last_key is None:
+                cursor.execute(f"""
+                    SELECT COUNT(*), MAX(k) FROM (
+                        SELECT TOP ({batch_size}) [{key}] AS k
+                        FROM {table} ORDER BY [{key}]
+                    ) s
+                """)
+            else:
+                cursor.execute(
+                    f"""
+                    SELECT COUNT(*), MAX(k) FROM (
+                        SELECT TOP ({batch_size}) [{key}] AS k
+                        FROM {table} WHERE [{key}] > ? ORDER BY [{key}]
+                    ) s
+                    """,
+                    last_key,
+                )
+            chunk_rows, upper_key = cursor.fetchone()
+            if upper_key is None:
+                break
+
+            chunk += 1
+            if last_key is None:
+                chunk_sql, params = bind_parameters(
+                    add_predicate(sql, f"{key_expr} <= ?"), self.parameters
+                )
+                params += [upper_key]
+            else:
+                chunk_sql, params = bind_parameters(
+                    add_predicate(sql, f"{key_expr} > ? AND {key_expr} <= ?"),
+                    self.parameters,
+                )
+                params += [last_key, upper_key]
+
+            def run_chunk():
+                cursor.execute(chunk_sql, *params)
+                chunk_rowcount = cursor.rowcount
+                conn.commit()
+                self.committed_units += 1
+                return chunk_rowcount
+
+            rows_affected += self.run_unit(
+                conn, run_chunk, f"Statement {idx} chunk {chunk}"
+            )
+            last_key = upper_key
+
+            self.progress(
+                f"Executing statement {idx}/{total_statements}: "
+                f"chunk {chunk} ({key} <= {upper_key}), {rows_affected} rows affected"
+            )
+            self.advance(chunk_rows)
+            if self.governor:
+                message = self.governor.update(cursor)
+                if message:
+                    self.progress(message)
+                self.governor.wait()
+
+        return rows_affected
+
+    def apply(self, conn):
+        """Apply the patch over conn and return a summary of what was done."""
+        cursor = self.cursor(conn)
+
+        # Check if backup exists
+        self.progress("Checking for backup...")
+        backup_tables = self.patch_config["backup_tables"]
+        original_count = len(self.patch_config["sql_statements"])
+        sql_statements = coalesce_statements(self.patch_config["sql_statements"])
+
+        update_targets = [
+            target[0]
+            for target in map(parse_update_target, sql_statements)
+            if target is not None
+        ]
+        self.pool.catalog.refresh(cursor, backup_tables + update_targets)
+        expected_rows = get_row_counts(cursor, backup_tables + update_targets)
+
+        # A column backup only covers patches changing the columns it holds
+        backup_columns = {
+            table: resolve_backup_columns(
+                self.pool.catalog,
+                table,
+                self.patch_config.get("backup_columns", {}).get(table),
+            )
+            for table in backup_tables
+        }
+        backup_exists = all(
+            self.pool.catalog.exists(self.pool.catalog.backup_name(table))
+            and set(backup_columns[table] or self.pool.catalog.columns(table)).issubset(
+                get_backup_columns(self.pool.catalog, table)
+            )
+            for table in backup_tables
+        )
+
+        # Create backup if it doesn't exist
+        if not backup_exists:
+            self.progress("Creating automatic backup...")
+            self.start_phase(
+                "Automatic backup",
+                sum(expected_rows.get(table, 0) for table in backup_tables),
+            )
+            generation = BackupStore.new_generation()
+            for table in backup_tables:
+                self.pool.backups.create_generation(
+                    cursor,
+                    self.pool.catalog,
+                    table,
+                    generation,
+                    self.patch_name,
+                    backup_columns[table],
+                )
+                self.advance(expected_rows.get(table, 0))
+            self.progress("Backup created successfully")
+
+        # In batched mode every chunk is committed on its own, so the backup
+        # has to be durable before the first chunk runs
+        if self.batch_size:
+            conn.commit()
+
+        # Apply patch statements; progress counts the rows of each statement's
+        # target table, as that is what the statement has to scan
+        total_statements = len(sql_statements)
+        rows_affected_total = 0
+        scanned_rows = [
+            expected_rows.get(target[0], 0) if target else 0
+            for target in map(parse_update_target, sql_statements)
+        ]
+        self.start_phase("Patch", sum(scanned_rows))
+
+        for idx, sql in enumerate(sql_statements, 1):
+            self.progress(f"Executing statement {idx}/{total_statements}...")
+            rows_affected = None
+            if self.batch_size:
+                rows_affected = self.execute_batched(
+                    conn, cursor, sql, idx, total_statements
+                )
+            if rows_affected is None:
+                bound_sql, params = bind_parameters(sql, self.parameters)
+                if self.batch_size:
+                    # Committed on its own, so it is its own unit of work
+                    def run_statement():
+                        cursor.execute(bound_sql, *params)
+                        statement_rowcount = cursor.rowcount
+                        conn.commit()
+                        self.committed_units += 1
+                        return statement_rowcount
+
+                    rows_affected = self.run_unit(
+                        conn, run_statement, f"Statement {idx}"
+                    )
+                else:
+                    cursor.execute(bound_sql, *params)
+                    rows_affected = cursor.rowcount
+                self.advance(scanned_rows[idx - 1])
+            rows_affected_total += rows_affected
+
+        self.progress("Committing changes...")
+        conn.commit()
+        self.count_rows(rows_affected_total)
+
+        summary = (
+            f"Successfully applied patch '{self.patch_name}'!\n\n"
+            f"Statements executed: {total_statements}"
+            + (
+                f" (coalesced from {original_count})"
+                if total_statements != original_count
+                else ""
+            )
+            + f"\nTotal rows affected: {rows_affected_total}"
+        )
+        if self.parameters:
+            summary += "\nParameters: " + ", ".join(
+                f"{name} = {value}" for name, value in self.parameters.items()
+            )
+        if "patches" in self.patch_config:
+            summary += (
+                f"\nPatches applied in one transaction: "
+                f"{len(self.patch_config['patches'])}"
+            )
+        if self.batch_size:
+            summary += f"\nBatched execution: {self.batch_size} rows per chunk"
+        if self.governor:
+            summary += "\n" + self.governor.format_summary()
+        if not backup_exists and self.pool.backups.compression_unsupported:
+            summary += f"\n{COMPRESSION_NOTE}"
+
+        return summary
+
+    def perform(self):
+        """Execute the patch."""
+        with self.pool.connection() as conn:
+            if self.batch_size:
+                # Chunks are committed separately and retried one by one
+                return self.apply(conn)
+            return self.run_unit(conn, lambda: self.apply(conn), "Patch")
+
+
+class EstimateJob(Job):
+    """Predict the rows a patch would affect without changing any data.
+
+    By default each statement is turned into a SELECT COUNT(*) with the same
+    predicates. With exact set, the statements are executed in a transaction
+    that is always rolled back, which also accounts for statements that
+    depend on each other. Results are cached on the pool until one of the
+    referenced tables is written to; for exact runs, writes made while the
+    statements ran cannot be told apart from their own rolled-back ones.
+    """
+
+    name = "estimate"
+
+    def __init__(self, pool, patch_name, patch_config, exact=False, parameters=None):
+        super().__init__(pool)
+        self.patch_name = patch_name
+        self.patch_config = patch_config
+        self.parameters = get_parameter_values(patch_config, parameters)
+        self.exact = exact
+        self.estimates = []
+        self.tables = get_referenced_tables(patch_config["sql_statements"])
+        # Exact estimates write, if only until the rollback
+        self.read_only = not exact
+
+    def get_change_stamp(self, cursor, tables):
+        """Return a value that changes whenever one of the tables is written to.
+
+        Based on sys.dm_db_index_usage_stats, which needs VIEW SERVER STATE;
+        returns None when it cannot be read so results are not cached.
+        """
+        values = ", ".join(["('" + table.replace("'", "''") + "')" for table in tables])
+        try:
+            cursor.execute(f"""
+                SELECT v.name, MAX(u.last_user_update)
+                FROM (VALUES {values}) v(name)
+                LEFT JOIN sys.dm_db_index_usage_stats u
+                    ON u.object_id = OBJECT_ID(v.name)
+                    AND u.database_id = DB_ID(ISNULL(PARSENAME(v.name, 3), DB_NAME()))
+                GROUP BY v.name
+            """)
+            return tuple(sorted(cursor.fetchall()))
+        except Exception:
+            return None
+
+    def perform(self):
+        """Estimate the rows affected by each statement of the patch."""
+        sql_statements = self.patch_config["sql_statements"]
+        tables = get_referenced_tables(sql_statements)
+        cache_key = (self.patch_name, self.exact, tuple(self.parameters.items()))
+
+        with self.pool.connection() as conn:
+            cursor = self.cursor(conn)
+            stamp = self.get_change_stamp(cursor, tables) if tables else None
+
+            cached = self.pool.estimates.get(cache_key)
+            if stamp is not None and cached and cached[0] == stamp:
+                self.estimates, estimated_at = cached[1], cached[2]
+                return self.format_summary(cached_at=estimated_at)
+
+            self.estimates = []
+            try:
+                for idx, sql in enumerate(sql_statements, 1):
+                    self.progress(
+                        f"Estimating statement {idx}/{len(sql_statements)}..."
+                    )
+                    count_query = None if self.exact else build_count_query(sql)
+                    start = time.monotonic()
+                    if count_query is not None:
+                        bound_sql, params = bind_parameters(
+                            count_query, self.parameters
+                        )
+                        cursor.execute(bound_sql, *params)
+                        rows = cursor.fetchone()[0]
+                    else:
+                        bound_sql, params = bind_parameters(sql, self.parameters)
+                        cursor.execute(bound_sql, *params)
+                        rows = cursor.rowcount
+                    self.estimates.append(
+                        (sql, rows, time.monotonic() - start, count_query is None)
+                    )
+            finally:
+                # Nothing done here may ever be committed
+                conn.rollback()
+
+            # The rolled-back writes of an exact run update the stamp as well,
+            # so it is cached as it is afterwards
+            if self.exact and stamp is not None:
+                stamp = self.get_change_stamp(cursor, tables)
+
+        if stamp is not None:
+            self.pool.estimates[cache_key] = (
+                stamp,
+                self.estimates,
+                time.strftime("%H:%M:%S"),
+            )
+        return self.format_summary()
+
+    def format_summary(self, cached_at=None):
+        """Return the per-statement estimates as a readable summary."""
+        lines = [f"Dry run of patch '{self.patch_name}'", ""]
+        for idx, (sql, rows, seconds, executed) in enumerate(self.estimates, 1):
+            statement = " ".join(sql.split())
+            if len(statement) > 70:
+                statement = statement[:67] + "..."
+            method = "executed and rolled back" if executed else "counted"
+            lines.append(f"{idx}. {statement}")
+            lines.append(f"    {rows} rows ({method}, {seconds:.2f}s)")
+
+        total_rows = sum(estimate[1] for estimate in self.estimates)
+        self.rows = total_rows
+        total_seconds = sum(estimate[2] for estimate in self.estimates)
+        lines.append("")
+        lines.append(f"Estimated rows affected: {total_rows} in {total_seconds:.2f}s")
+        if cached_at:
+            lines.append(
+                f"(cached result from {cached_at}, tables unchanged since then)"
+            )
+        return "\n".join(lines)
+
+
+def get_targets(config, names):
+    """Return (name, config) pairs for the configured targets named in names.
+
+    Targets are listed under "targets" in the configuration file; fields a
+    target does not set are taken from the top-level configuration. Targets
+    without a name are named after their server and database. The special
+    name "all" selects every target.
+    """
+    base = {key: value for key, value in config.items() if key != "targets"}
+    targets = {}
+    for target in config.get("targets", []):
+        target_config = dict(base)
+        target_config.update(target)
+        name = target_config.pop("name", None) or re.sub(
+            r"[^\w.-]+", "_", f"{target_config['server']}_{target_config['database']}"
+        )
+        if name in targets:
+            raise ValueError(f"Duplicate target name: {name}")
+        targets[name] = target_config
+
+    if not targets:
+        raise ValueError("No targets configured in the configuration file")
+    if names == ["all"]:
+        return list(targets.items())
+
+    unknown = [name for name in names if name not in targets]
+    if unknown:
+        raise ValueError(f"Unknown targets: {', '.join(unknown)}")
+    return [(name, targets[name]) for name in names]
+
+
+class FanOutJob(Job):
+    """Run the same jobs against many targets with a concurrency limit.
+
+    make_jobs(pool, config) returns the jobs to run in order for one target.
+    A failed target is retried up to retries times with backoff, unless one
+    of its jobs already committed part of its work, e.g. a chunk of a batched
+    patch: rerunning it would back up the partly patched tables and apply
+    the committed chunks a second time. With
+    fail_fast, targets that have not started yet are skipped after the first
+    failure. run() returns a combined report and raises if any target did not
+    succeed.
+    """
+
+    name = "fan-out"
+
+    def __init__(self, targets, make_jobs, concurrency=4, retries=0, fail_fast=False):
+        super().__init__(None)
+        self.targets = targets
+        self.make_jobs = make_jobs
+        self.concurrency = concurrency
+        self.retries = retries
+        self.fail_fast = fail_fast
+        self.results = []
+        self._stop = threading.Event()
+
+    def run_target(self, name, config):
+        """Run all jobs for one target and return its result entry."""
+        result = {"target": name, "status": "skipped", "attempts": 0, "seconds": 0.0}
+        if self._stop.is_set():
+            return result
+
+        def report(message):
+            self.progress(f"[{name}] {message}")
+
+        pool = create_pool(config)
+        start = time.monotonic()
+        try:
+            while True:
+                result["attempts"] += 1
+                jobs = []
+                try:
+                    jobs = self.make_jobs(pool, config)
+                    rows = []
+                    for job in jobs:
+                        job.on_progress = report
+                        job.run()
+                        rows.append(f"{job.name} {job.rows} rows")
+                        self.count_rows(job.rows)
+                    result.update(status="ok", message=", ".join(rows))
+                    return result
+                except Exception as e:
+                    result.update(status="failed", message=str(e).splitlines()[0])
+                    committed = sum(job.committed_units for job in jobs)
+                    if committed:
+                        result["message"] += (
+                            f" (not retried, {committed} chunks already committed)"
+                        )
+                    if (
+                        committed
+                        or result["attempts"] > self.retries
+                        or self._stop.is_set()
+                    ):
+                        if self.fail_fast:
+                            self._stop.set()
+                        return result
+                    delay = min(2 ** result["attempts"], 30)
+                    report(f"Attempt {result['attempts']} failed: {e}")
+                    report(f"Retrying in {delay}s...")
+                    time.sleep(delay)
+        finally:
+            result["seconds"] = time.monotonic() - start
+            pool.close()
+
+    def perform(self):
+        """Run against all targets and return the combined report."""
+        start = time.monotonic()
+        self.progress(
+            f"Running on {len(self.targets)} targets, {self.concurrency} at a time..."
+        )
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(self.run_target, name, config)
+                for name, config in self.targets
+            ]
+        self.results = [future.result() for future in futures]
+
+        succeeded = sum(1 for r in self.results if r["status"] == "ok")
+        failed = sum(1 for r in self.results if r["status"] == "failed")
+        skipped = len(self.results) - succeeded - failed
+        width = max(len(r["target"]) for r in self.results)
+
+        lines = [
+            f"Succeeded on {succeeded} of {len(self.results)} targets "
+            f"({failed} failed, {skipped} skipped) in "
+            f"{time.monotonic() - start:.1f}s, {self.rows} rows total",
+            "",
+        ]
+        for r in self.results:
+            lines.append(
+                f"{r['target']:<{width}}  {r['status'].upper():<7}  "
+                f"{r['seconds']:7.1f}s  {r['attempts']} attempt(s)  "
+                f"{r.get('message', '')}"
+            )
+
+        report = "\n".join(lines)
+        if succeeded != len(self.results):
+            raise Exception(report)
+        return report
+
+
+class ScheduledJob:
+    """A job submitted to a JobScheduler with its state, timings and result."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, number, job, label, on_finished=None):
+        self.number = number
+        self.job = job
+        self.label = label
+        self.on_finished = on_finished or (lambda scheduled: None)
+        self.tables = {normalize_table_name(table).lower() for table in job.tables}
+        self.state = self.QUEUED
+        self.queued_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # Summary of a succeeded job, or the exception a failed job raised
+        self.result = None
+        self.error = None
+
+    @property
+    def done(self):
+        """True once the job succeeded, failed or was cancelled."""
+        return self.state in (self.SUCCEEDED, self.FAILED, self.CANCELLED)
+
+    @property
+    def seconds(self):
+        """Seconds the job has been running so far, or ran in total."""
+        if self.started_at is None:
+            return 0.0
+        return ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+
+    def conflicts_with(self, other):
+        """Return True if the jobs share a table that one of them may change."""
+        if self.job.read_only and other.job.read_only:
+            return False
+        return bool(self.tables & other.tables)
+
+
+class JobScheduler:
+    """Queue of jobs run in the background, in parallel where they do not conflict.
+
+    A queued job starts once fewer than max_running jobs run and it conflicts
+    with neither a running job nor one queued before it, so jobs on the same
+    table run one after another in submission order while jobs on disjoint
+    tables overlap. Every submitted job stays in history.
+
+    on_change(scheduled) is called whenever a job is queued or changes state,
+    from the thread that caused the change.
+    """
+
+    def __init__(self, max_running=2):
+        self.max_running = max_running
+        self.on_change = lambda scheduled: None
+        self.history = []
+        self._lock = threading.Lock()
+
+    def submit(self, job, label=None, on_finished=None):
+        """Queue a job and return its ScheduledJob.
+
+        on_finished(scheduled) is called from the job's thread once it has
+        succeeded or failed.
+        """
+        with self._lock:
+            scheduled = ScheduledJob(
+                len(self.history) + 1, job, label or job.name, on_finished
+            )
+            self.history.append(scheduled)
+        self.on_change(scheduled)
+        self._start_ready()
+        return scheduled
+
+    def cancel(self, scheduled):
+        """Cancel a job that has not started yet; returns False if it has."""
+        with self._lock:
+            if scheduled.state != ScheduledJob.QUEUED:
+                return False
+            scheduled.state = ScheduledJob.CANCELLED
+            scheduled.finished_at = datetime.now()
+        self.on_change(scheduled)
+        # Jobs queued behind it may be able to start now
+        self._start_ready()
+        return True
+
+    def active(self):
+        """Return the queued and running jobs in submission order."""
+        with self._lock:
+            return [scheduled for scheduled in self.history if not scheduled.done]
+
+    def _start_ready(self):
+        """Start every queued job that may run now."""
+        started = []
+        with self._lock:
+            running = [
+                scheduled
+                for scheduled in self.history
+                if scheduled.state == ScheduledJob.RUNNING
+            ]
+            waiting = []
+            for scheduled in self.history:
+                if scheduled.state != ScheduledJob.QUEUED:
+                    continue
+                if len(running) >= self.max_running:
+                    break
+                if any(scheduled.conflicts_with(other) for other in running + waiting):
+                    waiting.append(scheduled)
+                    continue
+                scheduled.state = ScheduledJob.RUNNING
+                scheduled.started_at = datetime.now()
+                running.append(scheduled)
+                started.append(scheduled)
+
+        for scheduled in started:
+            self.on_change(scheduled)
+            threading.Thread(target=self._run, args=(scheduled,), daemon=True).start()
+
+    def _run(self, scheduled):
+        """Run one job, record its outcome and start the jobs waiting for it."""
+        try:
+            result = scheduled.job.run()
+            error = None
+        except Exception as e:
+            result, error = None, e
+        with self._lock:
+            scheduled.result = result
+            scheduled.error = error
+            scheduled.state = (
+                ScheduledJob.FAILED if error is not None else ScheduledJob.SUCCEEDED
+            )
+            scheduled.finished_at = datetime.now()
+        try:
+            scheduled.on_finished(scheduled)
+            self.on_change(scheduled)
+        finally:
+            self._start_ready()
@@ -1,8 +1,4 @@
 import sys
-import json
-import os
-from importlib.metadata import version, PackageNotFoundError
-import mssql_python
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -18,102 +14,44 @@ from PyQt6.QtWidgets import (
     QDialog,
     QDialogButtonBox,
     QComboBox,
+    QListWidget,
+    QListWidgetItem,
+    QInputDialog,
+    QTableView,
+    QTableWidget,
+    QTableWidgetItem,
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-
-
-def get_version():
-    """Read version from package metadata or pyproject.toml"""
-    try:
-        return version("srodbpatch")
-    except PackageNotFoundError:
-        pass
-
-    try:
-        import tomllib
-
-        pyproject_path = os.path.join(os.path.dirname(__file__), "pyproject.toml")
-        with open(pyproject_path, "rb") as f:
-            pyproject = tomllib.load(f)
-        return pyproject["project"]["version"]
-    except Exception as e:
-        raise RuntimeError(
-            "Could not determine version. Please ensure:\n"
-            "1. Package is installed with 'uv pip install -e .', or\n"
-            "2. pyproject.toml is accessible in the application directory.\n"
-            f"Error: {e}"
-        )
-
+from PyQt6.QtCore import (
+    Qt,
+    QObject,
+    QTimer,
+    pyqtSignal,
+    QAbstractTableModel,
+    QModelIndex,
+)
+from PyQt6.QtGui import QColor
+
+from engine import (
+    CONFIG_FILE,
+    BackupJob,
+    DiffJob,
+    EstimateJob,
+    JobScheduler,
+    PatchJob,
+    RestoreJob,
+    ScheduledJob,
+    combine_patches,
+    create_pool,
+    get_parameter_values,
+    get_version,
+    load_config,
+    save_config,
+)
+from patches import PATCHES
 
 __VERSION__ = get_version()
 
 
-# Patch definitions - each patch is a list of SQL statements
-PATCHES = {
-    "Level 120 Skills": {
-        "description": "Enable all level 120 skills by setting Service = 1",
-        "backup_tables": ["_RefSkill"],
-        "sql_statements": [
-            "UPDATE dbo._RefSkill SET Service = 1 WHERE (Basic_Code like 'SKILL_CH%' OR Basic_Code like 'SKILL_EU%') and ReqCommon_MasteryLevel1 <= 120",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 3437 AND 3440",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 7182 AND 7184",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID = 8384",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8321 AND 8331",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8417 AND 8418",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8585 AND 8593",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11286 AND 11289",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11323 AND 11332",
-            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11414 AND 11420",
-        ],
-    },
-    "Increase MaxStack to 1000": {
-        "description": "Increase maxstack of some items (potions, arrows, etc.), which where already stack-able (to prevent bugs).",
-        "backup_tables": ["_RefObjItem"],
-        "sql_statements": [
-            "UPDATE i SET i.MaxStack=1000 FROM _RefObjItem i INNER JOIN _RefObjCommon c ON i.ID = c.ID WHERE c.CodeName128 LIKE 'ITEM_ETC_%' AND i.MaxStack = 50"
-        ],
-    },
-    "Activate 12D items": {
-        "description": "Enable 12D items by setting Service = 1",
-        "backup_tables": ["_RefObjCommon"],
-        "sql_statements": [
-            "UPDATE dbo._RefObjCommon SET Service = 1 WHERE CodeName128 LIKE 'ITEM_CH_%_12_%' OR CodeName128 LIKE 'ITEM_EU_%_12_%'"
-        ],
-    },
-    "Add Silk to All Players": {
-        "description": "Add 10,000 Silk to all active player accounts",
-        "backup_tables": ["_Char"],
-        "sql_statements": [
-            """INSERT INTO SRO_VT_ACCOUNT.dbo.SK_Silk (JID, silk_own, silk_gift, silk_point)
-SELECT JID, 10000, 0, 0
-FROM SRO_VT_ACCOUNT.dbo.TB_User
-WHERE JID NOT IN (SELECT JID FROM SRO_VT_ACCOUNT.dbo.SK_Silk)""",
-            """UPDATE SRO_VT_ACCOUNT.dbo.SK_Silk
-SET silk_own = silk_own + 10000
-WHERE JID IN (SELECT JID FROM SRO_VT_ACCOUNT.dbo.TB_User)""",
-        ],
-    },
-    "Add gold to all characters": {
-        "description": "Add 99.000.000 gold to all characters",
-        "backup_tables": ["_Char"],
-        "sql_statements": [
-            "UPDATE dbo._Char SET RemainGold = RemainGold + 99000000 WHERE CharID > 0",
-        ],
-    },
-    "Reset Character Stats": {
-        "description": "Reset all character stats to base values and refund stat points",
-        "backup_tables": ["_Char"],
-        "sql_statements": [
-            """UPDATE dbo._Char
-SET Strength = 20 + (MaxLevel - 1),
-    Intellect = 20 + (MaxLevel - 1),
-    RemainStatPoint = (MaxLevel - 1) * 3
-WHERE CharID > 0""",
-        ],
-    },
-}
-
-
 class DatabaseSettingsDialog(QDialog):
     """Dialog for configuring database connection settings."""
 
@@ -143,6 +81,88 @@ class DatabaseSettingsDialog(QDialog):
         self.password_input.setEchoMode(QLineEdit.EchoMode.Password)
         form_layout.addRow("Password:", self.password_input)
 
+        self.batch_size_input = QLineEdit(str(current_settings.get("batch_size", 0)))
+        self.batch_size_input.setToolTip(
+            "Rows per chunk for batched patch execution (0 = disabled)"
+        )
+        form_layout.addRow("Batch Size:", self.batch_size_input)
+
+        self.workers_input = QLineEdit(str(current_settings.get("workers", 1)))
+        self.workers_input.setToolTip(
+            "Number of tables backed up or restored in parallel"
+        )
+        form_layout.addRow("Parallel Workers:", self.workers_input)
+
+        self.parallel_jobs_input = QLineEdit(
+            str(current_settings.get("parallel_jobs", 2))
+        )
+        self.parallel_jobs_input.setToolTip(
+            "Number of queued jobs run at the same time; jobs on the same tables "
+            "always run one after another"
+        )
+        form_layout.addRow("Parallel Jobs:", self.parallel_jobs_input)
+
+        self.backup_keep_input = QLineEdit(str(current_settings.get("backup_keep", 5)))
+        self.backup_keep_input.setToolTip(
+            "Backup generations kept per table (0 = unlimited)"
+        )
+        form_layout.addRow("Keep Backups:", self.backup_keep_input)
+
+        self.backup_max_gb_input = QLineEdit(
+            str(current_settings.get("backup_max_gb", 0))
+        )
+        self.backup_max_gb_input.setToolTip(
+            "Maximum size of all backup generations per table in GB (0 = unlimited)"
+        )
+        form_layout.addRow("Max Backup Size (GB):", self.backup_max_gb_input)
+
+        self.lock_timeout_input = QLineEdit(
+            str(current_settings.get("lock_timeout_ms", 5000))
+        )
+        self.lock_timeout_input.setToolTip(
+            "Milliseconds to wait for locks held by the game server (-1 = forever)"
+        )
+        form_layout.addRow("Lock Timeout (ms):", self.lock_timeout_input)
+
+        self.lock_retries_input = QLineEdit(
+            str(current_settings.get("lock_retries", 3))
+        )
+        self.lock_retries_input.setToolTip(
+            "Retries after a lock timeout or deadlock before giving up"
+        )
+        form_layout.addRow("Lock Retries:", self.lock_retries_input)
+
+        self.throttle_latency_input = QLineEdit(
+            str(current_settings.get("throttle_latency_ms", 0))
+        )
+        self.throttle_latency_input.setToolTip(
+            "Slow patches and restores down while server waits exceed this many "
+            "milliseconds (0 = disabled)"
+        )
+        form_layout.addRow("Throttle Latency (ms):", self.throttle_latency_input)
+
+        self.backup_database_input = QLineEdit(
+            current_settings.get("backup_database", "")
+        )
+        self.backup_database_input.setToolTip(
+            "Existing database to keep backups in, ideally with the simple recovery "
+            "model (empty = the patched database)"
+        )
+        form_layout.addRow("Backup Database:", self.backup_database_input)
+
+        self.backup_schema_input = QLineEdit(current_settings.get("backup_schema", ""))
+        self.backup_schema_input.setToolTip(
+            "Existing schema to keep backups in (empty = dbo)"
+        )
+        form_layout.addRow("Backup Schema:", self.backup_schema_input)
+
+        self.backup_compression_combo = QComboBox()
+        self.backup_compression_combo.addItems(["PAGE", "ROW", "NONE"])
+        self.backup_compression_combo.setCurrentText(
+            current_settings.get("backup_compression", "PAGE")
+        )
+        form_layout.addRow("Backup Compression:", self.backup_compression_combo)
+
         layout.addLayout(form_layout)
 
         button_box = QDialogButtonBox(
@@ -160,264 +180,306 @@ class DatabaseSettingsDialog(QDialog):
             "database": self.database_input.text().strip(),
             "user": self.user_input.text().strip(),
             "password": self.password_input.text(),
+            "batch_size": int(self.batch_size_input.text().strip() or 0),
+            "workers": max(1, int(self.workers_input.text().strip() or 1)),
+            "parallel_jobs": max(1, int(self.parallel_jobs_input.text().strip() or 1)),
+            "backup_keep": max(0, int(self.backup_keep_input.text().strip() or 0)),
+            "backup_max_gb": max(
+                0.0, float(self.backup_max_gb_input.text().strip() or 0)
+            ),
+            "lock_timeout_ms": max(
+                -1, int(self.lock_timeout_input.text().strip() or -1)
+            ),
+            "lock_retries": max(0, int(self.lock_retries_input.text().strip() or 0)),
+            "throttle_latency_ms": max(
+                0, int(self.throttle_latency_input.text().strip() or 0)
+            ),
+            "backup_database": self.backup_database_input.text().strip(),
+            "backup_schema": self.backup_schema_input.text().strip(),
+            "backup_compression": self.backup_compression_combo.currentText(),
         }
 
 
-class BackupWorker(QThread):
-    """Worker thread to create backup of specified tables."""
+class PatchSelectionDialog(QDialog):
+    """Dialog for selecting several patches to apply as one unit."""
 
-    progress = pyqtSignal(str)
-    finished = pyqtSignal(bool, str)
+    def __init__(self, parent=None, selected=None):
+        super().__init__(parent)
+        self.setWindowTitle("Apply Several Patches")
+        self.setModal(True)
 
-    def __init__(self, db_config, tables):
-        super().__init__()
-        self.db_config = db_config
-        self.tables = tables
+        layout = QVBoxLayout(self)
+        layout.addWidget(
+            QLabel("Selected patches are applied in this order in one transaction:")
+        )
 
-    def run(self):
-        """Create backup of specified tables."""
-        try:
-            conn = mssql_python.connect(self.db_config)
-            cursor = conn.cursor()
+        self.patch_list = QListWidget()
+        for patch_name in PATCHES:
+            item = QListWidgetItem(patch_name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(
+                Qt.CheckState.Checked
+                if patch_name in (selected or [])
+                else Qt.CheckState.Unchecked
+            )
+            self.patch_list.addItem(item)
+        layout.addWidget(self.patch_list)
 
-            backup_info = []
+        button_box = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
 
-            for table in self.tables:
-                backup_table = f"{table}_Backup"
-                self.progress.emit(f"Creating backup of {table}...")
+    def get_selected(self):
+        """Return the names of the checked patches."""
+        return [
+            self.patch_list.item(row).text()
+            for row in range(self.patch_list.count())
+            if self.patch_list.item(row).checkState() == Qt.CheckState.Checked
+        ]
 
-                cursor.execute(f"""
-                    IF OBJECT_ID('{backup_table}', 'U') IS NOT NULL
-                        DROP TABLE {backup_table}
-                """)
 
-                cursor.execute(f"""
-                    SELECT *
-                    INTO {backup_table}
-                    FROM {table}
-                """)
+class PatchParametersDialog(QDialog):
+    """Dialog for entering the parameter values of a patch."""
 
-                cursor.execute(f"SELECT COUNT(*) FROM {backup_table}")
-                row_count = cursor.fetchone()[0]
-                backup_info.append(f"{table}: {row_count} rows backed up")
+    def __init__(self, parent=None, patch_config=None):
+        super().__init__(parent)
+        self.setWindowTitle("Patch Parameters")
+        self.setModal(True)
 
-            conn.commit()
-            conn.close()
+        layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
 
-            self.finished.emit(
-                True,
-                "Backup created successfully!\n\n" + "\n".join(backup_info),
-            )
+        self.inputs = {}
+        for name, parameter in patch_config["parameters"].items():
+            value_input = QLineEdit(str(parameter.get("default", "")))
+            value_input.setToolTip(f"{name} ({parameter['type']})")
+            form_layout.addRow(f"{parameter.get('label', name)}:", value_input)
+            self.inputs[name] = value_input
 
-        except Exception as e:
-            self.finished.emit(False, f"Backup failed: {str(e)}")
+        layout.addLayout(form_layout)
 
+        button_box = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
 
-class RestoreWorker(QThread):
-    """Worker thread to restore from backup."""
+    def get_values(self):
+        """Return the entered values by parameter name."""
+        return {
+            name: value_input.text().strip()
+            for name, value_input in self.inputs.items()
+        }
 
-    progress = pyqtSignal(str)
-    finished = pyqtSignal(bool, str)
 
-    def __init__(self, db_config, tables):
-        super().__init__()
-        self.db_config = db_config
-        self.tables = tables
+class DiffTableModel(QAbstractTableModel):
+    """Table model over a TableDiff that loads rows as the view scrolls.
 
-    def run(self):
-        """Restore tables from backup."""
-        try:
-            conn = mssql_python.connect(self.db_config)
-            cursor = conn.cursor()
-
-            self.progress.emit("Checking for backups...")
-
-            for table in self.tables:
-                backup_table = f"{table}_Backup"
-                cursor.execute(f"""
-                    SELECT COUNT(*)
-                    FROM INFORMATION_SCHEMA.TABLES
-                    WHERE TABLE_NAME = '{backup_table}'
-                """)
-                if cursor.fetchone()[0] == 0:
-                    raise Exception(f"No backup found for {table}!")
-
-            restore_info = []
-
-            for table in self.tables:
-                backup_table = f"{table}_Backup"
-                self.progress.emit(f"Restoring {table} from backup...")
-
-                # Get primary key column(s) for this table
-                cursor.execute(f"""
-                    SELECT COLUMN_NAME
-                    FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
-                    WHERE OBJECTPROPERTY(OBJECT_ID(CONSTRAINT_SCHEMA + '.' + QUOTENAME(CONSTRAINT_NAME)), 'IsPrimaryKey') = 1
-                    AND TABLE_NAME = '{table}'
-                """)
-                pk_columns = [row[0] for row in cursor.fetchall()]
-
-                # Get all columns for the table
-                cursor.execute(f"""
-                    SELECT COLUMN_NAME
-                    FROM INFORMATION_SCHEMA.COLUMNS
-                    WHERE TABLE_NAME = '{table}'
-                """)
-                all_columns = [row[0] for row in cursor.fetchall()]
-
-                if pk_columns:
-                    # Build join condition on primary key
-                    join_condition = " AND ".join(
-                        [f"t.[{col}] = b.[{col}]" for col in pk_columns]
-                    )
-                    non_pk_columns = [
-                        col for col in all_columns if col not in pk_columns
-                    ]
-
-                    # Update existing rows
-                    if non_pk_columns:
-                        update_set = ", ".join(
-                            [f"t.[{col}] = b.[{col}]" for col in non_pk_columns]
-                        )
-                        cursor.execute(f"""
-                            UPDATE t
-                            SET {update_set}
-                            FROM {table} t
-                            INNER JOIN {backup_table} b ON {join_condition}
-                        """)
-
-                    # Insert rows that exist in backup but not in original
-                    pk_match = " AND ".join(
-                        [f"t.[{col}] = b.[{col}]" for col in pk_columns]
-                    )
-                    cursor.execute(f"""
-                        INSERT INTO {table}
-                        SELECT b.*
-                        FROM {backup_table} b
-                        WHERE NOT EXISTS (
-                            SELECT 1 FROM {table} t WHERE {pk_match}
-                        )
-                    """)
-
-                    # Delete rows that exist in original but not in backup (if no FK references)
-                    cursor.execute(f"""
-                        DELETE t
-                        FROM {table} t
-                        WHERE NOT EXISTS (
-                            SELECT 1 FROM {backup_table} b WHERE {join_condition}
-                        )
-                    """)
-                else:
-                    # Fallback: no primary key found, use original delete/insert approach
-                    cursor.execute(f"DELETE FROM {table}")
-                    cursor.execute(f"INSERT INTO {table} SELECT * FROM {backup_table}")
-
-                cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                row_count = cursor.fetchone()[0]
-                restore_info.append(f"{table}: {row_count} rows restored")
-
-            conn.commit()
-            conn.close()
-
-            self.finished.emit(
-                True,
-                "Restore completed successfully!\n\n" + "\n".join(restore_info),
-            )
+    Rows are announced page by page through canFetchMore/fetchMore, and cell
+    values are read from the page cache of the TableDiff, so memory use does
+    not grow with the size of the diff.
+    """
 
-        except Exception as e:
-            self.finished.emit(False, f"Restore failed: {str(e)}")
+    KIND_LABELS = {"U": "Changed", "I": "Added", "D": "Removed"}
+    KIND_COLORS = {"U": "#fff3cd", "I": "#d4edda", "D": "#f8d7da"}
+
+    def __init__(self, diff, parent=None):
+        super().__init__(parent)
+        self.diff = diff
+        self.loaded = 0
+
+    @staticmethod
+    def format_value(value):
+        return "NULL" if value is None else str(value)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.diff.columns) + 1
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < self.diff.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.diff.page_size, self.diff.total - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Vertical:
+            return str(section + 1)
+        return "Change" if section == 0 else self.diff.columns[section - 1]
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        kind, live, backup = self.diff.row(index.row())
+        column = index.column() - 1
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column < 0:
+                return self.KIND_LABELS[kind]
+            if kind == "D":
+                return self.format_value(backup[column])
+            if kind == "U" and live[column] != backup[column]:
+                return (
+                    f"{self.format_value(backup[column])} \u2192 "
+                    f"{self.format_value(live[column])}"
+                )
+            return self.format_value(live[column])
+        if role == Qt.ItemDataRole.BackgroundRole:
+            if kind == "U" and column >= 0 and live[column] == backup[column]:
+                return None
+            return QColor(self.KIND_COLORS[kind])
+        return None
+
+
+class DiffDialog(QDialog):
+    """Dialog showing the rows a table differs in from its backup."""
+
+    def __init__(self, parent=None, diff=None, summary=""):
+        super().__init__(parent)
+        self.setWindowTitle(f"Changes in {diff.table} since the backup")
+        self.resize(900, 600)
+        self.diff = diff
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(summary))
+
+        self.model = DiffTableModel(diff, self)
+        view = QTableView()
+        view.setModel(self.model)
+        # Fixed row heights keep the view from measuring rows it does not show
+        view.verticalHeader().setDefaultSectionSize(22)
+        layout.addWidget(view)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def done(self, result):
+        """Drop the diff on the server when the dialog is closed."""
+        self.diff.close()
+        super().done(result)
 
 
-class PatchWorker(QThread):
-    """Worker thread to apply database patches."""
+class JobWorker(QObject):
+    """Runs an engine job on the job scheduler and reports back through signals.
+
+    The signals are emitted from the thread of the job and delivered in the
+    GUI thread.
+    """
 
     progress = pyqtSignal(str)
+    rows = pyqtSignal(object)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, db_config, patch_name, patch_config):
+    def __init__(self, job, label):
         super().__init__()
-        self.db_config = db_config
-        self.patch_name = patch_name
-        self.patch_config = patch_config
+        self.job = job
+        self.label = label
+        self.scheduled = None
+        self.job.on_progress = self.progress.emit
+        self.job.on_row_progress = self.rows.emit
+
+    def format_result(self, message):
+        """Return the message shown when the job succeeds."""
+        report = self.job.report
+        if report.steps:
+            message = f"{message}\n\n{report.format_slowest(3)}"
+        if self.job.report_path:
+            message = f"{message}\n\nRun report: {self.job.report_path}"
+        return message
+
+    def format_error(self, error):
+        """Return the message shown when the job fails."""
+        return str(error)
+
+    def on_finished(self, scheduled):
+        """Report the outcome of the job."""
+        if scheduled.error is None:
+            self.finished.emit(True, self.format_result(scheduled.result))
+        else:
+            self.finished.emit(False, self.format_error(scheduled.error))
 
-    def run(self):
-        """Execute the patch."""
-        try:
-            conn = mssql_python.connect(self.db_config)
-            cursor = conn.cursor()
-
-            # Check if backup exists
-            self.progress.emit("Checking for backup...")
-            backup_tables = self.patch_config["backup_tables"]
-            backup_exists = True
-
-            for table in backup_tables:
-                backup_table = f"{table}_Backup"
-                cursor.execute(f"""
-                    SELECT COUNT(*)
-                    FROM INFORMATION_SCHEMA.TABLES
-                    WHERE TABLE_NAME = '{backup_table}'
-                """)
-                if cursor.fetchone()[0] == 0:
-                    backup_exists = False
-                    break
-
-            # Create backup if it doesn't exist
-            if not backup_exists:
-                self.progress.emit("Creating automatic backup...")
-                for table in backup_tables:
-                    backup_table = f"{table}_Backup"
-                    cursor.execute(f"""
-                        IF OBJECT_ID('{backup_table}', 'U') IS NOT NULL
-                            DROP TABLE {backup_table}
-                    """)
-                    cursor.execute(f"""
-                        SELECT *
-                        INTO {backup_table}
-                        FROM {table}
-                    """)
-                self.progress.emit("Backup created successfully")
-
-            # Apply patch statements
-            sql_statements = self.patch_config["sql_statements"]
-            total_statements = len(sql_statements)
-            rows_affected_total = 0
-
-            for idx, sql in enumerate(sql_statements, 1):
-                self.progress.emit(f"Executing statement {idx}/{total_statements}...")
-                cursor.execute(sql)
-                rows_affected = cursor.rowcount
-                rows_affected_total += rows_affected
-
-            self.progress.emit("Committing changes...")
-            conn.commit()
-            conn.close()
-
-            summary = (
-                f"Successfully applied patch '{self.patch_name}'!\n\n"
-                f"Statements executed: {total_statements}\n"
-                f"Total rows affected: {rows_affected_total}"
-            )
+    def start(self, scheduler):
+        """Queue the job on scheduler."""
+        self.scheduled = scheduler.submit(self.job, self.label, self.on_finished)
 
-            self.finished.emit(True, summary)
 
-        except Exception as e:
-            import traceback
+class BackupWorker(JobWorker):
+    """Worker to create backup of specified tables."""
+
+    def format_error(self, error):
+        return f"Backup failed: {str(error)}"
+
+
+class RestoreWorker(JobWorker):
+    """Worker to restore from backup."""
+
+    def format_error(self, error):
+        return f"Restore failed: {str(error)}"
+
+
+class EstimateWorker(JobWorker):
+    """Worker to estimate the rows a patch would affect."""
+
+    def format_error(self, error):
+        return f"Dry run failed: {str(error)}"
+
+
+class DiffWorker(JobWorker):
+    """Worker to compare a table with its backup."""
+
+    def format_error(self, error):
+        return f"Comparing with the backup failed: {str(error)}"
+
+
+class PatchWorker(JobWorker):
+    """Worker to apply database patches."""
 
-            error_details = traceback.format_exc()
-            self.finished.emit(False, f"Error: {str(e)}\n\nDetails:\n{error_details}")
+    def format_error(self, error):
+        import traceback
+
+        error_details = "".join(traceback.format_exception(error))
+        return f"Error: {str(error)}\n\nDetails:\n{error_details}"
+
+
+class SchedulerSignals(QObject):
+    """Delivers state changes of scheduled jobs to the GUI thread."""
+
+    changed = pyqtSignal(object)
 
 
 class DatabasePatchTool(QMainWindow):
-    CONFIG_FILE = "db_config.json"
+    CONFIG_FILE = CONFIG_FILE
 
     def __init__(self):
         super().__init__()
         self.setWindowTitle(f"Database Patch Management Tool v{__VERSION__}")
-        self.setGeometry(100, 100, 600, 480)
-        self.setMinimumSize(600, 480)
-
-        self.load_config()
+        self.setGeometry(100, 100, 700, 640)
+        self.setMinimumSize(600, 560)
+
+        self.config = load_config(self.CONFIG_FILE)
+        self.pool = create_pool(self.config)
+
+        # Jobs run in the background; the workers of unfinished jobs are kept
+        # here so their signals stay connected
+        self.scheduler = JobScheduler(self.config["parallel_jobs"])
+        self.scheduler_signals = SchedulerSignals()
+        self.scheduler_signals.changed.connect(self.on_job_changed)
+        self.scheduler.on_change = self.scheduler_signals.changed.emit
+        self.workers = []
+        # Last progress message and row progress of each unfinished job
+        self.job_messages = {}
+        self.job_row_progress = {}
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -519,25 +581,57 @@ class DatabasePatchTool(QMainWindow):
         backup_layout = QHBoxLayout()
 
         self.backup_button = QPushButton("Create Backup")
-        self.backup_button.clicked.connect(self.create_backup)
+        self.backup_button.clicked.connect(lambda: self.create_backup())
         self.backup_button.setStyleSheet("padding: 8px;")
         backup_layout.addWidget(self.backup_button)
 
+        self.incremental_backup_button = QPushButton("Incremental Backup")
+        self.incremental_backup_button.setToolTip(
+            "Store only rows changed since the last backup"
+        )
+        self.incremental_backup_button.clicked.connect(
+            lambda: self.create_backup(incremental=True)
+        )
+        self.incremental_backup_button.setStyleSheet("padding: 8px;")
+        backup_layout.addWidget(self.incremental_backup_button)
+
         self.restore_button = QPushButton("Restore from Backup")
         self.restore_button.clicked.connect(self.restore_backup)
         self.restore_button.setStyleSheet("padding: 8px;")
         backup_layout.addWidget(self.restore_button)
 
+        self.diff_button = QPushButton("View Changes...")
+        self.diff_button.setToolTip("Show the rows that differ from the backup")
+        self.diff_button.clicked.connect(self.view_changes)
+        self.diff_button.setStyleSheet("padding: 8px;")
+        backup_layout.addWidget(self.diff_button)
+
         layout.addLayout(backup_layout)
 
         # Apply button
         apply_layout = QHBoxLayout()
 
         self.apply_button = QPushButton("Apply Patch")
-        self.apply_button.clicked.connect(self.apply_patch)
+        self.apply_button.clicked.connect(lambda: self.apply_patch())
         self.apply_button.setStyleSheet("padding: 10px; font-size: 12pt;")
         apply_layout.addWidget(self.apply_button)
 
+        self.apply_several_button = QPushButton("Apply Several...")
+        self.apply_several_button.setToolTip(
+            "Apply several patches in one transaction with a single backup"
+        )
+        self.apply_several_button.clicked.connect(self.apply_several_patches)
+        self.apply_several_button.setStyleSheet("padding: 10px; font-size: 12pt;")
+        apply_layout.addWidget(self.apply_several_button)
+
+        self.dry_run_button = QPushButton("Dry Run")
+        self.dry_run_button.setToolTip(
+            "Estimate the rows the patch would affect without changing data"
+        )
+        self.dry_run_button.clicked.connect(self.dry_run_patch)
+        self.dry_run_button.setStyleSheet("padding: 10px; font-size: 12pt;")
+        apply_layout.addWidget(self.dry_run_button)
+
         layout.addLayout(apply_layout)
 
         # Status label
@@ -546,64 +640,62 @@ class DatabasePatchTool(QMainWindow):
         self.status_label.setStyleSheet("padding: 10px; background-color: #f0f0f0;")
         layout.addWidget(self.status_label)
 
-        layout.addStretch()
-
-        self.worker = None
+        # Job queue and history
+        layout.addWidget(QLabel("Jobs (double-click for details):"))
+        self.jobs_table = QTableWidget(0, 4)
+        self.jobs_table.setHorizontalHeaderLabels(
+            ["Job", "State", "Duration", "Progress"]
+        )
+        self.jobs_table.horizontalHeader().setStretchLastSection(True)
+        self.jobs_table.verticalHeader().setVisible(False)
+        self.jobs_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.jobs_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.jobs_table.cellDoubleClicked.connect(self.show_job)
+        self.jobs_table.itemSelectionChanged.connect(self.show_progress)
+        layout.addWidget(self.jobs_table)
+
+        # Keeps the durations of running jobs current
+        self.jobs_timer = QTimer(self)
+        self.jobs_timer.timeout.connect(self.refresh_running_jobs)
+        self.jobs_timer.start(1000)
+
+    def closeEvent(self, event):
+        """Close pooled connections when the window is closed."""
+        active = self.scheduler.active()
+        if active:
+            reply = QMessageBox.question(
+                self,
+                "Jobs Running",
+                f"{len(active)} job(s) are still queued or running.\n\n"
+                f"Quit anyway? Running jobs are rolled back by the server.",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No,
+            )
+            if reply == QMessageBox.StandardButton.No:
+                event.ignore()
+                return
+        self.pool.close()
+        super().closeEvent(event)
 
     def on_patch_selected(self, patch_name):
         """Update description when patch is selected."""
         if patch_name in PATCHES:
             patch_config = PATCHES[patch_name]
             description = patch_config["description"]
-            tables = ", ".join(patch_config["backup_tables"])
+            tables = ", ".join(
+                f"{table} ({', '.join(patch_config['backup_columns'][table])})"
+                if table in patch_config["backup_columns"]
+                else table
+                for table in patch_config["backup_tables"]
+            )
             self.description_label.setText(
                 f"{description}\n\nAffected tables: {tables}"
             )
 
-    def load_config(self):
-        """Load database configuration from file or use defaults."""
-        default_config = {
-            "server": "localhost",
-            "port": 1433,
-            "database": "SRO_VT_SHARD",
-            "user": "sa",
-            "password": "",
-        }
-
-        if os.path.exists(self.CONFIG_FILE):
-            try:
-                with open(self.CONFIG_FILE, "r") as f:
-                    config = json.load(f)
-                self.server = config.get("server", default_config["server"])
-                self.port = config.get("port", default_config["port"])
-                self.database = config.get("database", default_config["database"])
-                self.user = config.get("user", default_config["user"])
-                self.password = config.get("password", default_config["password"])
-            except Exception:
-                self.server = default_config["server"]
-                self.port = default_config["port"]
-                self.database = default_config["database"]
-                self.user = default_config["user"]
-                self.password = default_config["password"]
-        else:
-            self.server = default_config["server"]
-            self.port = default_config["port"]
-            self.database = default_config["database"]
-            self.user = default_config["user"]
-            self.password = default_config["password"]
-
     def save_config(self):
         """Save database configuration to file."""
-        config = {
-            "server": self.server,
-            "port": self.port,
-            "database": self.database,
-            "user": self.user,
-            "password": self.password,
-        }
         try:
-            with open(self.CONFIG_FILE, "w") as f:
-                json.dump(config, f, indent=2)
+            save_config(self.config, self.CONFIG_FILE)
         except Exception as e:
             QMessageBox.warning(
                 self, "Config Save Failed", f"Could not save configuration: {str(e)}"
@@ -611,23 +703,25 @@ class DatabasePatchTool(QMainWindow):
 
     def show_settings(self):
         """Show database settings dialog."""
-        current_settings = {
-            "server": self.server,
-            "port": self.port,
-            "database": self.database,
-            "user": self.user,
-            "password": self.password,
-        }
+        if self.scheduler.active():
+            # Queued jobs would still run against the old connection
+            QMessageBox.information(
+                self,
+                "Jobs Running",
+                "Settings can be changed once all queued and running jobs "
+                "have finished.",
+            )
+            return
 
-        dialog = DatabaseSettingsDialog(self, current_settings)
+        dialog = DatabaseSettingsDialog(self, self.config)
         if dialog.exec() == QDialog.DialogCode.Accepted:
-            new_settings = dialog.get_settings()
-            self.server = new_settings["server"]
-            self.port = new_settings["port"]
-            self.database = new_settings["database"]
-            self.user = new_settings["user"]
-            self.password = new_settings["password"]
+            self.config.update(dialog.get_settings())
             self.save_config()
+            self.scheduler.max_running = self.config["parallel_jobs"]
+
+            # Drop sessions opened with the old settings
+            self.pool.close()
+            self.pool = create_pool(self.config)
 
             QMessageBox.information(
                 self,
@@ -636,25 +730,13 @@ class DatabasePatchTool(QMainWindow):
                 "Click 'Test Connection' to verify the new settings.",
             )
 
-    def get_connection_string(self):
-        """Get the database connection string."""
-        return (
-            f"SERVER={self.server},{self.port};"
-            f"DATABASE={self.database};"
-            f"UID={self.user};"
-            f"PWD={self.password};"
-            f"Encrypt=yes;"
-            f"TrustServerCertificate=yes;"
-        )
-
     def test_connection(self):
         """Test the database connection."""
         try:
-            conn = mssql_python.connect(self.get_connection_string())
-            cursor = conn.cursor()
-            cursor.execute("SELECT @@VERSION")
-            version = cursor.fetchone()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT @@VERSION")
+                version = cursor.fetchone()
 
             QMessageBox.information(
                 self,
@@ -674,8 +756,8 @@ class DatabasePatchTool(QMainWindow):
                 "padding: 10px; background-color: #f8d7da; color: #721c24;"
             )
 
-    def create_backup(self):
-        """Create backup of tables for current patch."""
+    def create_backup(self, incremental=False):
+        """Create a full or incremental backup of tables for current patch."""
         patch_name = self.patch_combo.currentText()
         if patch_name not in PATCHES:
             return
@@ -683,12 +765,22 @@ class DatabasePatchTool(QMainWindow):
         patch_config = PATCHES[patch_name]
         tables = patch_config["backup_tables"]
 
+        if incremental:
+            replace_note = (
+                "Rows changed since the last backup will be added to the existing "
+                "backup. Tables without a backup, or whose backup does not hold "
+                "the columns this patch changes, get a new backup generation "
+                "instead.\n\n"
+            )
+        else:
+            replace_note = "Existing backups will be replaced.\n\n"
+
         reply = QMessageBox.question(
             self,
             "Create Backup",
             f"This will create a backup for patch: {patch_name}\n\n"
             f"Tables to backup: {', '.join(tables)}\n\n"
-            f"Existing backups will be replaced.\n\n"
+            f"{replace_note}"
             f"Continue?",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
             QMessageBox.StandardButton.Yes,
@@ -697,22 +789,20 @@ class DatabasePatchTool(QMainWindow):
         if reply == QMessageBox.StandardButton.No:
             return
 
-        self.apply_button.setEnabled(False)
-        self.test_button.setEnabled(False)
-        self.backup_button.setEnabled(False)
-        self.restore_button.setEnabled(False)
-        self.progress_bar.setMaximum(0)
-        self.progress_bar.setTextVisible(True)
-        self.status_label.setText("Creating backup...")
-        self.status_label.setStyleSheet(
-            "padding: 10px; background-color: #fff3cd; color: #856404;"
+        self.start_job(
+            BackupWorker(
+                BackupJob(
+                    self.pool,
+                    tables,
+                    incremental,
+                    self.config["workers"],
+                    columns=patch_config["backup_columns"],
+                ),
+                f"{'Incremental backup' if incremental else 'Backup'} for {patch_name}",
+            ),
+            self.on_backup_finished,
         )
 
-        self.worker = BackupWorker(self.get_connection_string(), tables)
-        self.worker.progress.connect(self.on_progress)
-        self.worker.finished.connect(self.on_backup_finished)
-        self.worker.start()
-
     def restore_backup(self):
         """Restore tables from backup for current patch."""
         patch_name = self.patch_combo.currentText()
@@ -736,38 +826,181 @@ class DatabasePatchTool(QMainWindow):
         if reply == QMessageBox.StandardButton.No:
             return
 
-        self.apply_button.setEnabled(False)
-        self.test_button.setEnabled(False)
-        self.backup_button.setEnabled(False)
-        self.restore_button.setEnabled(False)
-        self.progress_bar.setMaximum(0)
-        self.progress_bar.setTextVisible(True)
-        self.status_label.setText("Restoring from backup...")
-        self.status_label.setStyleSheet(
-            "padding: 10px; background-color: #fff3cd; color: #856404;"
-        )
+        ok, generation = self.choose_generation(tables)
+        if not ok:
+            return
 
-        self.worker = RestoreWorker(self.get_connection_string(), tables)
-        self.worker.progress.connect(self.on_progress)
-        self.worker.finished.connect(self.on_restore_finished)
-        self.worker.start()
+        self.start_job(
+            RestoreWorker(
+                RestoreJob(
+                    self.pool,
+                    tables,
+                    self.config["workers"],
+                    generation=generation,
+                    throttle_latency=self.config["throttle_latency_ms"],
+                    columns=patch_config["backup_columns"],
+                ),
+                f"Restore for {patch_name}",
+            ),
+            self.on_restore_finished,
+        )
 
-    def apply_patch(self):
-        """Apply the selected patch."""
+    def view_changes(self):
+        """Show the rows of a table of the current patch that differ from backup."""
         patch_name = self.patch_combo.currentText()
         if patch_name not in PATCHES:
             return
 
-        patch_config = PATCHES[patch_name]
+        tables = PATCHES[patch_name]["backup_tables"]
+        table = tables[0]
+        if len(tables) > 1:
+            table, ok = QInputDialog.getItem(
+                self,
+                "View Changes",
+                "Table to compare with its backup:",
+                tables,
+                0,
+                False,
+            )
+            if not ok:
+                return
+
+        worker = DiffWorker(DiffJob(self.pool, table), f"Changes in {table}")
+        self.start_job(
+            worker,
+            lambda success, message: self.on_diff_finished(
+                worker.job, success, message
+            ),
+        )
+
+    def ask_parameters(self, patch_config):
+        """Ask for the parameter values of a patch.
+
+        Returns the typed values, {} for patches without parameters, or None
+        if the dialog was cancelled or a value is invalid.
+        """
+        if not patch_config.get("parameters"):
+            return {}
+        dialog = PatchParametersDialog(self, patch_config)
+        if not dialog.exec():
+            return None
+        try:
+            return get_parameter_values(patch_config, dialog.get_values())
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Parameter", str(e))
+            return None
+
+    def choose_generation(self, tables):
+        """Ask which backup generation to restore if older ones are kept.
+
+        Returns (ok, generation) with generation None for the current backup.
+        """
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                per_table = [
+                    self.pool.backups.generations(cursor, table) for table in tables
+                ]
+        except Exception as e:
+            QMessageBox.critical(
+                self, "Restore Failed", f"Could not read backups:\n\n{str(e)}"
+            )
+            return False, None
+
+        # Only generations every table has can be restored together
+        common = [
+            generation["generation"]
+            for generation in per_table[0]
+            if all(
+                generation["generation"] in [other["generation"] for other in others]
+                for others in per_table
+            )
+        ]
+        if len(common) <= 1:
+            return True, None
+
+        current = {
+            generation["generation"]
+            for table, generations in zip(tables, per_table)
+            for generation in generations
+            if generation["backup_table"] == self.pool.catalog.backup_name(table)
+        }
+        items = [
+            f"{label} (current)" if current == {label} else label for label in common
+        ]
+        item, ok = QInputDialog.getItem(
+            self, "Restore Backup", "Backup generation to restore:", items, 0, False
+        )
+        if not ok:
+            return False, None
+        return True, common[items.index(item)]
+
+    def apply_several_patches(self):
+        """Select several patches and apply them in one transaction."""
+        dialog = PatchSelectionDialog(self, [self.patch_combo.currentText()])
+        if dialog.exec():
+            patch_names = dialog.get_selected()
+            if patch_names:
+                self.apply_patch(patch_names)
+
+    def apply_patch(self, patch_names=None):
+        """Apply the selected patch, or several patches as one unit."""
+        if patch_names is None:
+            patch_names = [self.patch_combo.currentText()]
+        if not all(patch_name in PATCHES for patch_name in patch_names):
+            return
+
+        if len(patch_names) == 1:
+            patch_name = patch_names[0]
+            patch_config = PATCHES[patch_name]
+        else:
+            patch_name = " + ".join(patch_names)
+            try:
+                patch_config = combine_patches(PATCHES, patch_names)
+            except ValueError as e:
+                QMessageBox.warning(self, "Cannot Combine Patches", str(e))
+                return
+
+        parameters = self.ask_parameters(patch_config)
+        if parameters is None:
+            return
+
+        # PatchJob decides on chunking, which throttling turns on as well
+        job = PatchJob(
+            self.pool,
+            patch_name,
+            patch_config,
+            self.config["batch_size"],
+            parameters,
+            self.config["throttle_latency_ms"],
+        )
 
         reply = QMessageBox.question(
             self,
             "Confirm Patch",
             f"This will apply patch: {patch_name}\n\n"
             f"{patch_config['description']}\n\n"
-            f"A backup will be created automatically before applying.\n"
-            f"You can restore from backup at any time.\n\n"
-            f"Continue?",
+            + (
+                "Parameters: "
+                + ", ".join(f"{name} = {value}" for name, value in parameters.items())
+                + "\n"
+                if parameters
+                else ""
+            )
+            + (
+                f"All {len(patch_names)} patches run in one transaction.\n"
+                f"Backup tables: {', '.join(patch_config['backup_tables'])}\n"
+                if len(patch_names) > 1
+                else ""
+            )
+            + "A backup will be created automatically before applying.\n"
+            + (
+                f"Statements run in chunks of {job.batch_size} rows, each committed separately.\n"
+                if job.batch_size
+                else ""
+            )
+            + "You can restore from backup at any time.\n\n"
+            "Continue?",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
             QMessageBox.StandardButton.No,
         )
@@ -775,38 +1008,184 @@ class DatabasePatchTool(QMainWindow):
         if reply == QMessageBox.StandardButton.No:
             return
 
-        self.apply_button.setEnabled(False)
-        self.test_button.setEnabled(False)
-        self.backup_button.setEnabled(False)
-        self.restore_button.setEnabled(False)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setTextVisible(True)
-        self.status_label.setText("Applying patch...")
+        self.start_job(
+            PatchWorker(job, f"Patch {patch_name}"),
+            self.on_patch_finished,
+        )
+
+    def dry_run_patch(self):
+        """Estimate the rows affected by the selected patch."""
+        patch_name = self.patch_combo.currentText()
+        if patch_name not in PATCHES:
+            return
+
+        parameters = self.ask_parameters(PATCHES[patch_name])
+        if parameters is None:
+            return
+
+        self.start_job(
+            EstimateWorker(
+                EstimateJob(
+                    self.pool, patch_name, PATCHES[patch_name], False, parameters
+                ),
+                f"Dry run of {patch_name}",
+            ),
+            self.on_dry_run_finished,
+        )
+
+    def start_job(self, worker, on_finished):
+        """Queue the job of worker; on_finished(success, message) handles its outcome.
+
+        The job starts once no job ahead of it in the queue works on the same
+        tables.
+        """
+        self.workers.append(worker)
+        worker.progress.connect(lambda message: self.on_progress(worker, message))
+        worker.rows.connect(lambda progress: self.on_row_progress(worker, progress))
+        worker.finished.connect(
+            lambda success, message: self.on_job_finished(
+                worker, on_finished, success, message
+            )
+        )
+        worker.start(self.scheduler)
         self.status_label.setStyleSheet(
             "padding: 10px; background-color: #fff3cd; color: #856404;"
         )
+        self.show_progress()
+
+    def on_job_finished(self, worker, on_finished, success, message):
+        """Forget a finished job and reset the progress bar once all are done."""
+        self.workers.remove(worker)
+        self.job_messages.pop(worker.scheduled.number, None)
+        self.job_row_progress.pop(worker.scheduled.number, None)
+        self.update_job_row(worker.scheduled)
+        self.show_progress()
+        on_finished(success, message)
+
+    def on_job_changed(self, scheduled):
+        """Show a job that was queued or changed state."""
+        self.update_job_row(scheduled)
+        self.show_progress()
+
+    def update_job_row(self, scheduled):
+        """Show the state, duration and last message of a job in the jobs table."""
+        row = scheduled.number - 1
+        if row >= self.jobs_table.rowCount():
+            self.jobs_table.setRowCount(row + 1)
+
+        if scheduled.state == ScheduledJob.SUCCEEDED:
+            text = scheduled.result.splitlines()[0] if scheduled.result else ""
+        elif scheduled.state == ScheduledJob.FAILED:
+            text = (str(scheduled.error).splitlines() or [""])[0]
+        else:
+            text = self.job_messages.get(scheduled.number, "")
+            progress = self.job_row_progress.get(scheduled.number)
+            if progress is not None:
+                text = f"{text} - {progress}" if text else str(progress)
+        duration = f"{scheduled.seconds:.0f}s" if scheduled.started_at else ""
+
+        for column, value in enumerate(
+            [scheduled.label, scheduled.state.capitalize(), duration, text]
+        ):
+            self.jobs_table.setItem(row, column, QTableWidgetItem(value))
+
+    def refresh_running_jobs(self):
+        """Update the durations of running jobs."""
+        for scheduled in self.scheduler.active():
+            if scheduled.state == ScheduledJob.RUNNING:
+                self.update_job_row(scheduled)
+
+    def show_job(self, row, column):
+        """Show the result of a job, or offer to cancel it while it is queued."""
+        scheduled = self.scheduler.history[row]
+        if scheduled.state == ScheduledJob.QUEUED:
+            reply = QMessageBox.question(
+                self,
+                "Queued Job",
+                f"{scheduled.label} is waiting for jobs on the same tables.\n\n"
+                f"Cancel it?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No,
+            )
+            if reply == QMessageBox.StandardButton.Yes:
+                self.scheduler.cancel(scheduled)
+            return
 
-        self.worker = PatchWorker(
-            self.get_connection_string(), patch_name, patch_config
+        if scheduled.state == ScheduledJob.SUCCEEDED:
+            details = scheduled.result
+        elif scheduled.state == ScheduledJob.FAILED:
+            details = str(scheduled.error)
+        else:
+            details = self.job_messages.get(scheduled.number, "")
+        QMessageBox.information(
+            self,
+            scheduled.label,
+            f"State: {scheduled.state}\n"
+            f"Queued at: {scheduled.queued_at:%H:%M:%S}\n"
+            f"Duration: {scheduled.seconds:.1f}s\n\n{details}",
         )
-        self.worker.progress.connect(self.on_progress)
-        self.worker.finished.connect(self.on_patch_finished)
-        self.worker.start()
 
-    def on_progress(self, message):
-        """Handle progress updates from worker."""
-        self.status_label.setText(message)
+    def on_progress(self, worker, message):
+        """Handle progress updates from a worker."""
+        self.job_messages[worker.scheduled.number] = message
+        self.update_job_row(worker.scheduled)
+        if worker.scheduled is self.progress_job():
+            self.show_progress()
+
+    def on_row_progress(self, worker, progress):
+        """Record row-based progress, throughput and ETA from a worker."""
+        self.job_row_progress[worker.scheduled.number] = progress
+        self.update_job_row(worker.scheduled)
+        if worker.scheduled is self.progress_job():
+            self.show_progress()
+
+    def progress_job(self):
+        """Return the unfinished job shown in the progress bar, or None.
+
+        That is the job selected in the jobs table, or else the oldest
+        running job, or else the oldest queued one.
+        """
+        active = self.scheduler.active()
+        rows = self.jobs_table.selectionModel().selectedRows()
+        if rows:
+            selected = self.scheduler.history[rows[0].row()]
+            if selected in active:
+                return selected
+        running = [job for job in active if job.state == ScheduledJob.RUNNING]
+        return (running or active or [None])[0]
+
+    def show_progress(self):
+        """Show the progress of one job in the progress bar and status label.
+
+        Jobs run in parallel, so the others show theirs in the jobs table.
+        """
+        scheduled = self.progress_job()
+        if scheduled is None:
+            self.progress_bar.setMaximum(100)
+            self.progress_bar.setValue(0)
+            self.progress_bar.setTextVisible(False)
+            return
+
+        progress = self.job_row_progress.get(scheduled.number)
+        self.progress_bar.setTextVisible(True)
+        if progress is not None and progress.total:
+            self.progress_bar.setMaximum(1000)
+            self.progress_bar.setValue(
+                min(progress.done * 1000 // progress.total, 1000)
+            )
+        else:
+            self.progress_bar.setMaximum(0)
+
+        if scheduled.state == ScheduledJob.QUEUED:
+            text = f"Queued: {scheduled.label}"
+        else:
+            text = f"{scheduled.label}: {self.job_messages.get(scheduled.number, '')}"
+        if progress is not None:
+            text = f"{text}\n{progress}"
+        self.status_label.setText(text)
 
     def on_backup_finished(self, success, message):
         """Handle backup completion."""
-        self.apply_button.setEnabled(True)
-        self.test_button.setEnabled(True)
-        self.backup_button.setEnabled(True)
-        self.restore_button.setEnabled(True)
-        self.progress_bar.setMaximum(100)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setTextVisible(False)
-
         if success:
             QMessageBox.information(self, "Backup Complete", message)
             self.status_label.setText("Backup created successfully")
@@ -822,14 +1201,6 @@ class DatabasePatchTool(QMainWindow):
 
     def on_restore_finished(self, success, message):
         """Handle restore completion."""
-        self.apply_button.setEnabled(True)
-        self.test_button.setEnabled(True)
-        self.backup_button.setEnabled(True)
-        self.restore_button.setEnabled(True)
-        self.progress_bar.setMaximum(100)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setTextVisible(False)
-
         if success:
             QMessageBox.information(self, "Restore Complete", message)
             self.status_label.setText("Restore completed successfully")
@@ -843,15 +1214,23 @@ class DatabasePatchTool(QMainWindow):
                 "padding: 10px; background-color: #f8d7da; color: #721c24;"
             )
 
+    def on_diff_finished(self, job, success, message):
+        """Open the diff view once the diff has been computed."""
+        if success:
+            self.status_label.setText("Comparison completed")
+            self.status_label.setStyleSheet(
+                "padding: 10px; background-color: #d4edda; color: #155724;"
+            )
+            DiffDialog(self, job.diff, message).exec()
+        else:
+            QMessageBox.critical(self, "Comparison Failed", message)
+            self.status_label.setText("Comparison failed")
+            self.status_label.setStyleSheet(
+                "padding: 10px; background-color: #f8d7da; color: #721c24;"
+            )
+
     def on_patch_finished(self, success, message):
         """Handle patch completion."""
-        self.apply_button.setEnabled(True)
-        self.test_button.setEnabled(True)
-        self.backup_button.setEnabled(True)
-        self.restore_button.setEnabled(True)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setTextVisible(False)
-
         if success:
             QMessageBox.information(self, "Patch Applied", message)
             self.status_label.setText("Patch applied successfully")
@@ -865,6 +1244,21 @@ class DatabasePatchTool(QMainWindow):
                 "padding: 10px; background-color: #f8d7da; color: #721c24;"
             )
 
+    def on_dry_run_finished(self, success, message):
+        """Handle dry run completion."""
+        if success:
+            QMessageBox.information(self, "Dry Run", message)
+            self.status_label.setText("Dry run completed - no data was changed")
+            self.status_label.setStyleSheet(
+                "padding: 10px; background-color: #d4edda; color: #155724;"
+            )
+        else:
+            QMessageBox.critical(self, "Dry Run Failed", message)
+            self.status_label.setText("Dry run failed")
+            self.status_label.setStyleSheet(
+                "padding: 10px; background-color: #f8d7da; color: #721c24;"
+            )
+
 
 def main():
     app = QApplication(sys.argv)
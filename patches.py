@@ -0,0 +1,89 @@
+"""Patch definitions shipped with the tool."""
+
+from engine import prepare_patch
+
+# Patch definitions - each patch is a list of SQL statements. Optional
+# "parameters" declare typed values (int, decimal or str) that statements
+# reference as @name; they are bound by the driver, not pasted into the SQL.
+# A statement may also be a declarative {"upsert": {...}} that updates
+# existing rows and inserts missing ones in one pass (see build_upsert).
+# Tables the statements write are backed up automatically; "backup_tables"
+# only needs to list tables beyond those. Tables only changed by UPDATEs get
+# a backup of just their primary key and the columns the SET clauses assign;
+# "backup_columns" ({table: [columns]}) overrides the inferred columns.
+PATCHES = {
+    "Level 120 Skills": {
+        "description": "Enable all level 120 skills by setting Service = 1",
+        "backup_tables": ["_RefSkill"],
+        "sql_statements": [
+            "UPDATE dbo._RefSkill SET Service = 1 WHERE (Basic_Code like 'SKILL_CH%' OR Basic_Code like 'SKILL_EU%') and ReqCommon_MasteryLevel1 <= 120",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 3437 AND 3440",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 7182 AND 7184",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID = 8384",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8321 AND 8331",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8417 AND 8418",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 8585 AND 8593",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11286 AND 11289",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11323 AND 11332",
+            "UPDATE dbo._RefSkill SET Service = 0 WHERE ID BETWEEN 11414 AND 11420",
+        ],
+    },
+    "Increase MaxStack to 1000": {
+        "description": "Increase maxstack of some items (potions, arrows, etc.), which where already stack-able (to prevent bugs).",
+        "backup_tables": ["_RefObjItem"],
+        "sql_statements": [
+            "UPDATE i SET i.MaxStack=1000 FROM _RefObjItem i INNER JOIN _RefObjCommon c ON i.ID = c.ID WHERE c.CodeName128 LIKE 'ITEM_ETC_%' AND i.MaxStack = 50"
+        ],
+    },
+    "Activate 12D items": {
+        "description": "Enable 12D items by setting Service = 1",
+        "backup_tables": ["_RefObjCommon"],
+        "sql_statements": [
+            "UPDATE dbo._RefObjCommon SET Service = 1 WHERE CodeName128 LIKE 'ITEM_CH_%_12_%' OR CodeName128 LIKE 'ITEM_EU_%_12_%'"
+        ],
+    },
+    "Add Silk to All Players": {
+        "description": "Add Silk (10,000 by default) to all active player accounts",
+        "parameters": {
+            "silk": {"type": "int", "default": 10000, "label": "Silk per account"},
+        },
+        "sql_statements": [
+            {
+                "upsert": {
+                    "target": "SRO_VT_ACCOUNT.dbo.SK_Silk",
+                    "source": "SRO_VT_ACCOUNT.dbo.TB_User",
+                    "key": "JID",
+                    "update": {"silk_own": "t.silk_own + @silk"},
+                    "insert": {
+                        "silk_own": "@silk",
+                        "silk_gift": "0",
+                        "silk_point": "0",
+                    },
+                }
+            },
+        ],
+    },
+    "Add gold to all characters": {
+        "description": "Add gold (99.000.000 by default) to all characters",
+        "backup_tables": ["_Char"],
+        "parameters": {
+            "gold": {"type": "int", "default": 99000000, "label": "Gold per character"},
+        },
+        "sql_statements": [
+            "UPDATE dbo._Char SET RemainGold = RemainGold + @gold WHERE CharID > 0",
+        ],
+    },
+    "Reset Character Stats": {
+        "description": "Reset all character stats to base values and refund stat points",
+        "backup_tables": ["_Char"],
+        "sql_statements": [
+            """UPDATE dbo._Char
+SET Strength = 20 + (MaxLevel - 1),
+    Intellect = 20 + (MaxLevel - 1),
+    RemainStatPoint = (MaxLevel - 1) * 3
+WHERE CharID > 0""",
+        ],
+    },
+}
+
+PATCHES = {name: prepare_patch(config) for name, config in PATCHES.items()}